@@ -6,7 +6,6 @@ Utility to check which environments are configured and test connections
 
 import os
 import sys
-from qb_auth_manager import QuickBooksAuthManager
 
 
 def check_environment(env_name: str):
@@ -15,6 +14,8 @@ def check_environment(env_name: str):
     print("-" * 40)
     
     try:
+        # Imported here so loading this module doesn't pull in requests
+        from qb_auth_manager import QuickBooksAuthManager
         auth = QuickBooksAuthManager(environment=env_name)
         
         print(f"📁 Credentials file: {auth.credentials_file}")
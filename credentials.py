@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+Shared credentials loader
+Parses credentials.config once per file version and returns a read-only mapping
+"""
+
+import os
+import re
+from functools import lru_cache
+from pathlib import Path
+from types import MappingProxyType
+from typing import Mapping
+
+
+CREDENTIALS_FILE = "credentials.config"
+
+# KEY=value lines; comment lines never match because keys must start with a letter or underscore
+_CRED_RE = re.compile(rb"^[ \t]*([A-Za-z_]\w*)[ \t]*=[ \t]*(.*?)[ \t\r]*$", re.M)
+
+
+def load_credentials(path: str = CREDENTIALS_FILE) -> Mapping[str, str]:
+    """Load all credentials from credentials.config (cached until the file changes, immutable)."""
+    return _parse_credentials(path, os.stat(path).st_mtime_ns)
+
+
+@lru_cache(maxsize=4)
+def _parse_credentials(path: str, mtime_ns: int) -> Mapping[str, str]:
+    """Parse a credentials file; the mtime key makes a rewritten file (e.g. refreshed tokens) parse again."""
+    text = Path(path).read_bytes()
+    credentials = {key.decode(): value.decode() for key, value in _CRED_RE.findall(text)}
+    return MappingProxyType(credentials)
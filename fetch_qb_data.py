@@ -4,74 +4,128 @@ Fetch QuickBooks customers and items using credentials.config
 """
 
 import os
-import requests
-import json
+import sys
+import argparse
+import orjson
+from qb_http import (SESSION, QB_BASE_URLS, run_batch, paged_query, fetch_query_pages,
+                     get_cached_base_url, cache_base_url, forget_base_url,
+                     get_cached_query, cache_query)
+from credentials import load_credentials
 
 
-def load_credentials():
-    """Load all credentials from credentials.config."""
-    credentials = {}
-    with open("credentials.config", 'r') as f:
-        for line in f:
-            line = line.strip()
-            if '=' in line and not line.startswith('#'):
-                key, value = line.split('=', 1)
-                credentials[key.strip()] = value.strip()
-    return credentials
+CUSTOMER_QUERY = 'SELECT * FROM Customer'
+ITEM_QUERY = 'SELECT * FROM Item WHERE Active = true'
 
 
-def test_connection(base_url, headers, realm_id):
-    """Test if we can connect to QuickBooks."""
-    url = f"{base_url}/v3/company/{realm_id}/query"
-    params = {'query': 'SELECT * FROM Customer MAXRESULTS 1'}
+def fetch_all(base_url, realm_id):
+    """
+    Probe connectivity and fetch customers and items in a single batch request.
+    
+    Returns:
+        Dict of bId -> batch sub-response, or None if this environment is unreachable
+    """
+    batch_items = [
+        {'bId': 'probe', 'Query': 'SELECT COUNT(*) FROM Customer'},
+        {'bId': 'customers', 'Query': paged_query(CUSTOMER_QUERY)},
+        {'bId': 'item_count', 'Query': 'SELECT COUNT(*) FROM Item WHERE Active = true'},
+        {'bId': 'items', 'Query': paged_query(ITEM_QUERY)}
+    ]
     
     try:
-        response = requests.get(url, headers=headers, params=params, timeout=10)
-        if response.status_code == 200:
-            return "Connected"
+        responses = run_batch(base_url, realm_id, batch_items, timeout=30)
+    except Exception:
         return None
-    except:
+    
+    # The probe sub-response confirms the token and realm are valid for this environment
+    if 'QueryResponse' not in responses.get('probe', {}):
         return None
+    return responses
 
 
-def fetch_customers(base_url, headers, realm_id):
-    """Fetch all customers."""
-    url = f"{base_url}/v3/company/{realm_id}/query"
-    params = {'query': 'SELECT * FROM Customer'}
-    
-    try:
-        response = requests.get(url, headers=headers, params=params)
-        response.raise_for_status()
-        
-        data = response.json()
-        if 'QueryResponse' in data and 'Customer' in data['QueryResponse']:
-            return data['QueryResponse']['Customer']
-        return []
-    except Exception as e:
-        print(f"❌ Error fetching customers: {e}")
+def extract_entities(responses, bid, entity):
+    """Pull an entity list out of a batch sub-response, reporting any fault."""
+    item = responses.get(bid, {})
+    if 'Fault' in item:
+        print(f"❌ Error fetching {bid}: {item['Fault']}")
         return []
+    return item.get('QueryResponse', {}).get(entity, [])
 
 
-def fetch_items(base_url, headers, realm_id):
-    """Fetch all items/services."""
-    url = f"{base_url}/v3/company/{realm_id}/query"
-    params = {'query': 'SELECT * FROM Item WHERE Active = true'}
-    
+def fetch_remaining_pages(base_url, realm_id, responses, count_bid, query, entity):
+    """
+    Fetch any pages beyond the first one returned by the batch, concurrently.
+    
+    Returns:
+        List of records, or None if a page failed (so a partial list is never cached)
+    """
+    total_count = responses.get(count_bid, {}).get('QueryResponse', {}).get('totalCount', 0)
     try:
-        response = requests.get(url, headers=headers, params=params)
-        response.raise_for_status()
-        
-        data = response.json()
-        if 'QueryResponse' in data and 'Item' in data['QueryResponse']:
-            return data['QueryResponse']['Item']
-        return []
+        return fetch_query_pages(base_url, realm_id, query, entity, total_count, first_page=1)
     except Exception as e:
-        print(f"❌ Error fetching items: {e}")
-        return []
+        print(f"❌ Error fetching {entity} pages: {e}")
+        return None
+
+
+def fetch_entity(base_url, realm_id, responses, bid, count_bid, query, entity):
+    """
+    Combine the batch's first page with the remaining pages and cache the result if complete.
+    A faulted first page or a failed later page is returned as-is but not cached.
+    """
+    records = extract_entities(responses, bid, entity)
+    remaining = fetch_remaining_pages(base_url, realm_id, responses, count_bid, query, entity)
+    
+    if remaining is not None and 'Fault' not in responses.get(bid, {}):
+        records += remaining
+        cache_query(realm_id, query, records)
+    return records
+
+
+def connect_and_fetch(realm_id, environments, cached_url):
+    """
+    Find the environment this realm lives in and fetch its customers and items.
+    
+    Returns:
+        (env_name, company_name, customers, items), or None if no environment connects
+    """
+    # Try the environment detected on a previous run first so the usual case is one request
+    environments = sorted(environments, key=lambda env: env[1] != cached_url)
+    
+    # Each probe is a single batch call that also carries the customer and item queries
+    for env_name, base_url in environments:
+        print(f"\n🔍 Testing {env_name}...")
+        responses = fetch_all(base_url, realm_id)
+        if responses:
+            cache_base_url(realm_id, base_url)
+            company = "Connected"
+            print(f"✅ Connected to {env_name}: {company}")
+            break
+        else:
+            print(f"❌ Failed to connect to {env_name}")
+            if base_url == cached_url:
+                forget_base_url(realm_id)
+    else:
+        return None
+    
+    # Data arrived with the connectivity probe
+    print(f"\n📋 Fetching data from {env_name}...")
+    customers = fetch_entity(base_url, realm_id, responses, 'customers', 'probe', CUSTOMER_QUERY, 'Customer')
+    items = fetch_entity(base_url, realm_id, responses, 'items', 'item_count', ITEM_QUERY, 'Item')
+    
+    return env_name, company, customers, items
+
+
+def parse_arguments():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Fetch QuickBooks customers and items')
+    parser.add_argument('--refresh', action='store_true',
+                       help='Ignore cached results and refetch from QuickBooks')
+    return parser.parse_args()
 
 
 def main():
     """Main function."""
+    args = parse_arguments()
+    
     print("🚀 QuickBooks Data Fetcher")
     print("=" * 50)
     
@@ -84,77 +138,63 @@ def main():
         print("❌ Missing credentials in credentials.config")
         return
     
-    headers = {
+    SESSION.headers.update({
         'Authorization': f'Bearer {access_token}',
         'Accept': 'application/json'
-    }
+    })
     
     # Test sandbox first, then production
-    environments = [
-        ("SANDBOX", "https://sandbox-quickbooks.api.intuit.com"),
-        ("PRODUCTION", "https://quickbooks.api.intuit.com")
-    ]
+    environments = [(name.upper(), base_url) for name, base_url in QB_BASE_URLS.items()]
+    cached_url = get_cached_base_url(realm_id)
+    
+    # Results cached by an earlier run against the same environment skip the network entirely
+    customers = items = None
+    if cached_url and not args.refresh:
+        customers = get_cached_query(realm_id, CUSTOMER_QUERY)
+        items = get_cached_query(realm_id, ITEM_QUERY)
+    cached_env = next((name for name, url in environments if url == cached_url), None)
+    
+    if cached_env and customers is not None and items is not None:
+        env_name = cached_env
+        company_name = "Connected (cached)"
+        print(f"\n📦 Using cached {env_name} data from the last 24 hours (use --refresh to refetch)")
+    else:
+        connected = connect_and_fetch(realm_id, environments, cached_url)
+        if not connected:
+            print("\n❌ Could not connect to any environment")
+            return
+        env_name, company_name, customers, items = connected
+    
+    # Build the customer and item report, then write it in one go
+    lines = []
     
-    connected_env = None
-    company_name = None
-    
-    for env_name, base_url in environments:
-        print(f"\n🔍 Testing {env_name}...")
-        company = test_connection(base_url, headers, realm_id)
-        if company:
-            print(f"✅ Connected to {env_name}: {company}")
-            connected_env = (env_name, base_url)
-            company_name = company
-            break
-        else:
-            print(f"❌ Failed to connect to {env_name}")
-    
-    if not connected_env:
-        print("\n❌ Could not connect to any environment")
-        return
-    
-    env_name, base_url = connected_env
-    
-    # Fetch data
-    print(f"\n📋 Fetching data from {env_name}...")
-    customers = fetch_customers(base_url, headers, realm_id)
-    items = fetch_items(base_url, headers, realm_id)
-    
-    # Display customers
     if customers:
-        print(f"\n" + "="*60)
-        print(f"💼 CUSTOMERS ({len(customers)} found)")
-        print("="*60)
+        lines += ["", "="*60, f"💼 CUSTOMERS ({len(customers)} found)", "="*60]
         
         for customer in customers:
-            name = customer.get('Name', 'N/A')
-            customer_id = customer.get('Id', 'N/A')
             active = customer.get('Active', True)
-            
-            print(f"Name: {name}")
-            print(f"ID: {customer_id}")
-            print(f"Status: {'Active' if active else 'Inactive'}")
-            print("-" * 30)
+            lines += [
+                f"Name: {customer.get('Name', 'N/A')}",
+                f"ID: {customer.get('Id', 'N/A')}",
+                f"Status: {'Active' if active else 'Inactive'}",
+                "-" * 30
+            ]
     
-    # Display items
     if items:
-        print(f"\n" + "="*60)
-        print(f"🛍️ ITEMS/SERVICES ({len(items)} found)")
-        print("="*60)
+        lines += ["", "="*60, f"🛍️ ITEMS/SERVICES ({len(items)} found)", "="*60]
         
         for item in items:
-            name = item.get('Name', 'N/A')
-            item_id = item.get('Id', 'N/A')
-            item_type = item.get('Type', 'N/A')
-            
-            print(f"Name: {name}")
-            print(f"ID: {item_id}")
-            print(f"Type: {item_type}")
-            
+            lines += [
+                f"Name: {item.get('Name', 'N/A')}",
+                f"ID: {item.get('Id', 'N/A')}",
+                f"Type: {item.get('Type', 'N/A')}"
+            ]
             if 'UnitPrice' in item:
-                print(f"Unit Price: ${item['UnitPrice']}")
-            
-            print("-" * 30)
+                lines.append(f"Unit Price: ${item['UnitPrice']}")
+            lines.append("-" * 30)
+    
+    if lines:
+        sys.stdout.write("\n".join(lines) + "\n")
     
     # Save results
     output = {
@@ -166,8 +206,8 @@ def main():
     }
     
     filename = f"qb_data_{env_name.lower()}.json"
-    with open(filename, 'w') as f:
-        json.dump(output, f, indent=2)
+    with open(filename, 'wb') as f:
+        f.write(orjson.dumps(output, option=orjson.OPT_INDENT_2))
     
     print(f"\n💾 Data saved to: {filename}")
     print(f"\n🎯 SUMMARY:")
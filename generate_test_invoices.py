@@ -5,21 +5,44 @@ Generates December retainer + October overage invoices for all clients
 """
 
 import os
-import requests
 import json
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime
+from requests import Session
+from qb_http import SESSION, QB_BASE_URLS, BATCH_LIMIT, run_batch
+from credentials import load_credentials
 
 
-def load_credentials():
-    """Load all credentials from credentials.config."""
-    credentials = {}
-    with open("credentials.config", 'r') as f:
-        for line in f:
-            line = line.strip()
-            if '=' in line and not line.startswith('#'):
-                key, value = line.split('=', 1)
-                credentials[key.strip()] = value.strip()
-    return credentials
+SANDBOX_BASE_URL = QB_BASE_URLS["sandbox"]
+
+# Fixed parts of each line item; calculate_line_items only fills in the per-client amounts
+_RETAINER_TEMPLATE = {
+    'DetailType': 'SalesItemLineDetail',
+    'SalesItemLineDetail': {
+        'ItemRef': {'value': '1'},  # Generic "Services" item
+        'Qty': 1,
+        'ServiceDate': '2025-12-01'
+    },
+    'Description': 'Monthly Retainer - December 2025'
+}
+
+_OVERAGE_TEMPLATE = {
+    'DetailType': 'SalesItemLineDetail',
+    'SalesItemLineDetail': {
+        'ItemRef': {'value': '24'},  # Hourly Services Overage
+        'ServiceDate': '2025-10-31'
+    }
+}
+
+
+@dataclass
+class QBClient:
+    """QuickBooks connection details, built once per run."""
+    session: Session
+    base_url: str
+    realm_id: str
 
 
 def fetch_notion_time_data():
@@ -65,92 +88,106 @@ def fetch_notion_time_data():
 
 def calculate_line_items(client_name, client_data):
     """Calculate invoice line items for a client."""
-    line_items = []
+    rate = client_data['retainer_rate']
     
     # December Retainer (always included)
-    line_items.append({
-        'DetailType': 'SalesItemLineDetail',
-        'Amount': client_data['retainer_rate'],
-        'SalesItemLineDetail': {
-            'ItemRef': {'value': '1'},  # Generic "Services" item
-            'Qty': 1,
-            'UnitPrice': client_data['retainer_rate'],
-            'ServiceDate': '2025-12-01'
-        },
-        'Description': f'Monthly Retainer - December 2025'
-    })
+    retainer = {**_RETAINER_TEMPLATE, 'Amount': rate}
+    retainer['SalesItemLineDetail'] = {**_RETAINER_TEMPLATE['SalesItemLineDetail'], 'UnitPrice': rate}
+    line_items = [retainer]
+    total_amount = rate
     
     # October Overages (only if client exceeded hours)
     overage_hours = max(0, client_data['october_hours'] - client_data['retainer_hours'])
     if overage_hours > 0:
-        overage_amount = overage_hours * client_data['overage_rate']
-        line_items.append({
-            'DetailType': 'SalesItemLineDetail', 
-            'Amount': overage_amount,
-            'SalesItemLineDetail': {
-                'ItemRef': {'value': '24'},  # Hourly Services Overage
-                'Qty': overage_hours,
-                'UnitPrice': client_data['overage_rate'],
-                'ServiceDate': '2025-10-31'
-            },
-            'Description': f'Overage Hours - October 2025 ({overage_hours} hrs @ ${client_data["overage_rate"]}/hr)'
-        })
-    
-    return line_items, overage_hours
-
-
-def create_qb_invoice(client_name, client_data, line_items):
-    """Create a QuickBooks draft invoice."""
-    creds = load_credentials()
-    access_token = creds.get('INTUIT_ACCESS_TOKEN')
-    realm_id = creds.get('INTUIT_REALM_ID')
-    
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-        'Accept': 'application/json',
-        'Content-Type': 'application/json'
-    }
-    
-    # Calculate total amount
-    total_amount = sum(item['Amount'] for item in line_items)
+        overage_rate = client_data['overage_rate']
+        overage = {
+            **_OVERAGE_TEMPLATE,
+            'Amount': overage_hours * overage_rate,
+            'Description': f'Overage Hours - October 2025 ({overage_hours} hrs @ ${overage_rate}/hr)'
+        }
+        overage['SalesItemLineDetail'] = {**_OVERAGE_TEMPLATE['SalesItemLineDetail'],
+                                          'Qty': overage_hours, 'UnitPrice': overage_rate}
+        line_items.append(overage)
+        total_amount += overage['Amount']
     
-    invoice_data = {
+    return line_items, overage_hours, total_amount
+
+
+def build_invoice_data(client_data, line_items):
+    """Build the QuickBooks invoice payload for a client."""
+    return {
         'CustomerRef': {'value': client_data['client_id']},
         'TxnDate': '2025-12-15',  # Invoice date (15th of month)
         'DueDate': '2026-01-15',  # Due date (30 days)
         'Line': line_items
     }
+
+
+def create_qb_invoices_batch(qb, invoices):
+    """
+    Create draft invoices through the QuickBooks batch endpoint (up to 30 per request,
+    with the requests sent concurrently). If a batch request fails outright its invoices
+    are reported as failed rather than re-posted, since QuickBooks may already have created them.
     
-    url = f"https://sandbox-quickbooks.api.intuit.com/v3/company/{realm_id}/invoice"
-    
-    try:
-        print(f"\\n📧 Creating invoice for {client_name}...")
-        print(f"   Customer ID: {client_data['client_id']}")
-        print(f"   Total Amount: ${total_amount}")
-        print(f"   Line Items: {len(line_items)}")
+    Args:
+        qb: QBClient for the target company
+        invoices: Dict of client_name -> (client_data, line_items, total_amount)
         
-        response = requests.post(url, headers=headers, json=invoice_data)
+    Returns:
+        Dict of client_name -> result: {'success', 'invoice_id', 'invoice_number', 'total_amount'}
+        on success, or {'success': False, 'error'}
+    """
+    client_names = list(invoices)
+    chunks = [client_names[start:start + BATCH_LIMIT] for start in range(0, len(client_names), BATCH_LIMIT)]
+    results = {}
+    
+    def submit_chunk(chunk):
+        batch_items = [
+            {'bId': str(i), 'operation': 'create', 'Invoice': build_invoice_data(*invoices[name][:2])}
+            for i, name in enumerate(chunk)
+        ]
+        try:
+            # Idempotency key so automatic retries of this POST cannot create duplicate invoices
+            return run_batch(qb.base_url, qb.realm_id, batch_items, session=qb.session,
+                             params={'requestid': uuid.uuid4().hex})
+        except Exception as e:
+            return e
+    
+    print(f"\n📧 Creating {len(client_names)} invoices in {len(chunks)} batch request(s)...")
+    
+    # Batch requests go out concurrently over the pooled session; results are reported in order
+    with ThreadPoolExecutor(max_workers=max(1, min(4, len(chunks)))) as executor:
+        chunk_responses = list(executor.map(submit_chunk, chunks))
+    
+    for chunk, responses in zip(chunks, chunk_responses):
+        if isinstance(responses, Exception):
+            error = f"Batch request failed ({responses}) - check QuickBooks before re-running"
+            print(f"   ❌ {error}: {', '.join(chunk)}")
+            for name in chunk:
+                results[name] = {'success': False, 'error': error}
+            continue
         
-        if response.status_code == 200:
-            result = response.json()
-            invoice = result['Invoice']
-            invoice_id = invoice['Id']
-            invoice_num = invoice['DocNumber']
-            print(f"   ✅ Invoice created: #{invoice_num} (ID: {invoice_id})")
-            return {
-                'success': True,
-                'invoice_id': invoice_id,
-                'invoice_number': invoice_num,
-                'total_amount': total_amount
-            }
-        else:
-            print(f"   ❌ Error: {response.status_code}")
-            print(f"   Response: {response.text}")
-            return {'success': False, 'error': response.text}
+        for i, name in enumerate(chunk):
+            total_amount = invoices[name][2]
+            item = responses.get(str(i), {})
             
-    except Exception as e:
-        print(f"   ❌ Exception: {e}")
-        return {'success': False, 'error': str(e)}
+            if 'Invoice' in item:
+                invoice = item['Invoice']
+                invoice_id = invoice['Id']
+                invoice_num = invoice.get('DocNumber', 'N/A')
+                print(f"   ✅ {name}: Invoice created #{invoice_num} (ID: {invoice_id}) - ${total_amount}")
+                results[name] = {
+                    'success': True,
+                    'invoice_id': invoice_id,
+                    'invoice_number': invoice_num,
+                    'total_amount': total_amount
+                }
+            else:
+                error = json.dumps(item.get('Fault', 'No response for batch item'))
+                print(f"   ❌ {name}: {error}")
+                results[name] = {'success': False, 'error': error}
+    
+    return results
 
 
 def main():
@@ -158,10 +195,19 @@ def main():
     print("🧾 Test Invoice Generation - December Retainer + October Overages")
     print("=" * 70)
     
+    # Set auth headers once on the shared session
+    creds = load_credentials()
+    SESSION.headers.update({
+        'Authorization': f"Bearer {creds.get('INTUIT_ACCESS_TOKEN')}",
+        'Accept': 'application/json',
+        'Content-Type': 'application/json'
+    })
+    qb = QBClient(SESSION, SANDBOX_BASE_URL, creds.get('INTUIT_REALM_ID'))
+    
     # Fetch client data
     clients_data = fetch_notion_time_data()
     
-    results = {}
+    invoices = {}
     
     for client_name, client_data in clients_data.items():
         print(f"\\n🏢 Processing {client_name}")
@@ -169,16 +215,17 @@ def main():
         print(f"   October actual: {client_data['october_hours']} hrs")
         
         # Calculate line items
-        line_items, overage_hours = calculate_line_items(client_name, client_data)
+        line_items, overage_hours, total_amount = calculate_line_items(client_name, client_data)
         
         if overage_hours > 0:
             print(f"   Overage: {overage_hours} hrs @ ${client_data['overage_rate']}/hr")
         else:
             print(f"   No overages (under retainer by {client_data['retainer_hours'] - client_data['october_hours']} hrs)")
         
-        # Create QuickBooks invoice
-        result = create_qb_invoice(client_name, client_data, line_items)
-        results[client_name] = result
+        invoices[client_name] = (client_data, line_items, total_amount)
+    
+    # Create all QuickBooks invoices in a single batch round-trip
+    results = create_qb_invoices_batch(qb, invoices)
     
     # Summary
     print(f"\\n" + "=" * 70)
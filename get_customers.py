@@ -5,29 +5,19 @@ Reads from credentials.config and determines production vs sandbox environment.
 """
 
 import os
-import requests
-import json
-from typing import Dict, List
+import re
+import argparse
+from typing import Dict, List, Optional
 import sys
+from credentials import CREDENTIALS_FILE, load_credentials
 
+# requests (via qb_http) and orjson are imported inside the functions that use them, so the
+# interactive prompts appear without waiting on the HTTP stack to load
 
-def load_credentials():
-    """Load credentials from credentials.config file."""
-    config_file = "credentials.config"
-    
-    if not os.path.exists(config_file):
-        print(f"❌ Credentials file not found: {config_file}")
-        sys.exit(1)
-    
-    credentials = {}
-    with open(config_file, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if '=' in line and not line.startswith('#'):
-                key, value = line.split('=', 1)
-                credentials[key.strip()] = value.strip()
-    
-    return credentials
+
+# Notion client names to highlight as potential matches, compiled into one case-insensitive scan
+NOTION_CLIENTS = ['aba', 'humangood', 'american bankers', 'american banker']
+NOTION_CLIENT_RE = re.compile("|".join(re.escape(name) for name in NOTION_CLIENTS), re.IGNORECASE)
 
 
 def get_access_token(client_id: str, client_secret: str) -> str:
@@ -61,27 +51,35 @@ def get_realm_id() -> str:
     return realm_id
 
 
-def detect_environment(access_token: str, realm_id: str) -> Dict:
+def detect_environment(realm_id: str, use_cache: bool = True) -> Optional[Dict]:
     """
     Try to detect if we're using sandbox or production by making test calls.
+    A result detected on a previous run is reused without probing (marked 'cached').
+    Returns None if the token is rejected, since probing another environment would not help.
     """
+    import orjson
+    import requests
+    from qb_http import SESSION, QB_BASE_URLS, get_cached_base_url, cache_base_url
+    
     environments = [
         {
             "name": "sandbox",
-            "base_url": "https://sandbox-quickbooks.api.intuit.com",
+            "base_url": QB_BASE_URLS["sandbox"],
             "description": "Sandbox (test environment)"
         },
         {
-            "name": "production", 
-            "base_url": "https://quickbooks.api.intuit.com",
+            "name": "production",
+            "base_url": QB_BASE_URLS["production"],
             "description": "Production (live environment)"
         }
     ]
     
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-        'Accept': 'application/json'
-    }
+    if use_cache:
+        cached_url = get_cached_base_url(realm_id)
+        for env in environments:
+            if env['base_url'] == cached_url:
+                print(f"\n🔍 Using previously detected environment: {env['description']}")
+                return {**env, 'cached': True}
     
     print("\n🔍 DETECTING ENVIRONMENT...")
     
@@ -91,11 +89,16 @@ def detect_environment(access_token: str, realm_id: str) -> Dict:
         url = f"{env['base_url']}/v3/company/{realm_id}/companyinfo/{realm_id}"
         
         try:
-            response = requests.get(url, headers=headers, timeout=10)
+            response = SESSION.get(url, timeout=10)
             
             if response.status_code == 200:
-                print(f"   ✅ SUCCESS: Connected to {env['description']}")
+                company = orjson.loads(response.content).get('CompanyInfo', {}).get('CompanyName', 'Unknown')
+                print(f"   ✅ SUCCESS: Connected to {env['description']} ({company})")
+                cache_base_url(realm_id, env['base_url'])
                 return env
+            elif response.status_code in (401, 403):
+                print(f"   ❌ Failed: {response.status_code} - token invalid or expired")
+                return None
             else:
                 print(f"   ❌ Failed: {response.status_code}")
                 
@@ -106,95 +109,98 @@ def detect_environment(access_token: str, realm_id: str) -> Dict:
     return environments[0]  # Default to sandbox
 
 
-def fetch_customers(base_url: str, access_token: str, realm_id: str) -> List[Dict]:
-    """Fetch all customers from QuickBooks."""
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-        'Accept': 'application/json'
-    }
-    
-    url = f"{base_url}/v3/company/{realm_id}/query"
-    params = {'query': 'SELECT * FROM Customer'}
+def fetch_customers(base_url: str, realm_id: str, refresh: bool = False) -> List[Dict]:
+    """
+    Fetch all customers from QuickBooks, paging concurrently past the 1000-row limit.
+    Results from the last 24 hours are reused from the local query cache unless refresh is set.
+    """
+    import orjson
+    import requests
+    from qb_http import query_all
     
     print(f"\n📋 Fetching customers from {base_url}...")
     
     try:
-        response = requests.get(url, headers=headers, params=params)
-        response.raise_for_status()
+        customers = query_all(base_url, realm_id, 'Customer', refresh=refresh)
         
-        data = response.json()
-        
-        if 'QueryResponse' in data and 'Customer' in data['QueryResponse']:
-            customers = data['QueryResponse']['Customer']
+        if customers:
             print(f"✅ Found {len(customers)} customers")
             return customers
         else:
             print("⚠️  No customers found")
             return []
             
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
         print(f"❌ Failed to fetch customers: {e}")
-        if hasattr(e, 'response') and e.response:
+        if getattr(e, 'response', None) is not None:
             print(f"Response: {e.response.text}")
         return []
 
 
 def display_customers(customers: List[Dict], environment: str):
-    """Display customers in a readable format."""
-    print(f"\n" + "="*60)
-    print(f"💼 CUSTOMERS ({environment.upper()} ENVIRONMENT)")
-    print("="*60)
-    
-    # Look for potential matches to Notion clients
-    notion_clients = ['aba', 'humangood', 'american bankers', 'american banker']
+    """Display customers in a readable format (buffered into a single write)."""
+    lines = ["", "="*60, f"💼 CUSTOMERS ({environment.upper()} ENVIRONMENT)", "="*60]
     
     for customer in customers:
         name = customer.get('Name', 'N/A')
-        customer_id = customer.get('Id', 'N/A')
         company = customer.get('CompanyName', '')
         active = customer.get('Active', True)
         
         # Check if this might match a Notion client
-        is_match = False
-        for notion_client in notion_clients:
-            if notion_client in name.lower() or notion_client in company.lower():
-                is_match = True
-                break
+        is_match = bool(NOTION_CLIENT_RE.search(name) or NOTION_CLIENT_RE.search(company))
         
         # Display with highlighting for potential matches
         if is_match:
-            print(f"🎯 POTENTIAL MATCH:")
+            lines.append("🎯 POTENTIAL MATCH:")
         
-        print(f"Name: {name}")
-        print(f"ID: {customer_id}")
+        lines.append(f"Name: {name}")
+        lines.append(f"ID: {customer.get('Id', 'N/A')}")
         
         if company:
-            print(f"Company: {company}")
+            lines.append(f"Company: {company}")
         
-        print(f"Status: {'Active' if active else 'Inactive'}")
+        lines.append(f"Status: {'Active' if active else 'Inactive'}")
         
         if is_match:
-            print(f"💡 This might match a Notion client!")
+            lines.append("💡 This might match a Notion client!")
         
-        print("-" * 30)
+        lines.append("-" * 30)
     
-    print(f"\n📝 NEXT STEPS:")
-    print(f"1. Copy the relevant Customer IDs above")
-    print(f"2. Update your Notion Clients database:")
-    print(f"   - ABA client → QB Customer ID field")
-    print(f"   - HumanGood client → QB Customer ID field")
+    lines += [
+        "",
+        "📝 NEXT STEPS:",
+        "1. Copy the relevant Customer IDs above",
+        "2. Update your Notion Clients database:",
+        "   - ABA client → QB Customer ID field",
+        "   - HumanGood client → QB Customer ID field"
+    ]
     
     if environment == "sandbox":
-        print(f"3. ⚠️  Remember: These are SANDBOX IDs for testing only")
-        print(f"4. You'll need PRODUCTION IDs when going live")
+        lines.append("3. ⚠️  Remember: These are SANDBOX IDs for testing only")
+        lines.append("4. You'll need PRODUCTION IDs when going live")
+    
+    sys.stdout.write("\n".join(lines) + "\n")
+
+
+def parse_arguments():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Fetch QuickBooks customer IDs')
+    parser.add_argument('--refresh', action='store_true',
+                       help='Ignore cached customer results and refetch from QuickBooks')
+    return parser.parse_args()
 
 
 def main():
     """Main function."""
+    args = parse_arguments()
+    
     print("🚀 QuickBooks Customer ID Fetcher")
     print("=" * 40)
     
     # Load credentials
+    if not os.path.exists(CREDENTIALS_FILE):
+        print(f"❌ Credentials file not found: {CREDENTIALS_FILE}")
+        sys.exit(1)
     credentials = load_credentials()
     client_id = credentials.get('INTUIT_CLIENT_ID')
     client_secret = credentials.get('INTUIT_CLIENT_SECRET')
@@ -210,25 +216,45 @@ def main():
     access_token = get_access_token(client_id, client_secret)
     realm_id = get_realm_id()
     
+    from qb_http import SESSION, forget_base_url
+    SESSION.headers.update({
+        'Authorization': f'Bearer {access_token}',
+        'Accept': 'application/json'
+    })
+    
     # Detect environment
-    env_info = detect_environment(access_token, realm_id)
+    env_info = detect_environment(realm_id)
+    if env_info is None:
+        print("\n❌ QuickBooks rejected the access token - get a fresh token and try again")
+        sys.exit(1)
     
     # Fetch customers
-    customers = fetch_customers(env_info['base_url'], access_token, realm_id)
+    customers = fetch_customers(env_info['base_url'], realm_id, refresh=args.refresh)
+    
+    # A cached environment that no longer works (e.g. token now for another realm) is re-probed once
+    if not customers and env_info.get('cached'):
+        print("⚠️  Cached environment returned no customers - re-detecting...")
+        forget_base_url(realm_id)
+        env_info = detect_environment(realm_id, use_cache=False)
+        if env_info is None:
+            print("\n❌ QuickBooks rejected the access token - get a fresh token and try again")
+            sys.exit(1)
+        customers = fetch_customers(env_info['base_url'], realm_id, refresh=True)
     
     # Display results
     if customers:
         display_customers(customers, env_info['name'])
         
         # Save to file
+        import orjson
         output_file = f"customers_{env_info['name']}.json"
-        with open(output_file, 'w') as f:
-            json.dump({
+        with open(output_file, 'wb') as f:
+            f.write(orjson.dumps({
                 'environment': env_info['name'],
                 'base_url': env_info['base_url'],
                 'realm_id': realm_id,
                 'customers': customers
-            }, f, indent=2)
+            }, option=orjson.OPT_INDENT_2))
         
         print(f"\n💾 Data saved to: {output_file}")
     else:
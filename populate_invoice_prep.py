@@ -5,38 +5,96 @@ Usage: python populate_invoice_prep.py --overage-start 2025-10-01 --overage-end
 """
 
 import os
+import sys
+import time
 import requests
 import json
+import orjson
 import argparse
+import uuid
+from collections import ChainMap
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from qb_auth_manager import QuickBooksAuthManager
+from functools import lru_cache
+from types import MappingProxyType
+from qb_auth_manager import QuickBooksAuthManager, TokenBucket
+from credentials import load_credentials
+from qb_http import BATCH_LIMIT, create_session
 
 
-def load_credentials():
-    """Load all credentials from credentials.config."""
-    credentials = {}
-    with open("credentials.config", 'r') as f:
-        for line in f:
-            line = line.strip()
-            if '=' in line and not line.startswith('#'):
-                key, value = line.split('=', 1)
-                credentials[key.strip()] = value.strip()
-    return credentials
+# Notion's API rate limit averages 3 requests per second per integration; every Notion
+# request takes a token from this shared bucket, whatever thread it runs on
+NOTION_REQUESTS_PER_SECOND = 3
+NOTION_RATE_LIMITER = TokenBucket(capacity=NOTION_REQUESTS_PER_SECOND, refill_rate_per_sec=NOTION_REQUESTS_PER_SECOND)
 
+# Concurrent Notion page lookups (the rate itself is enforced by NOTION_RATE_LIMITER)
+NOTION_MAX_CONCURRENCY = 3
 
+# Largest page Notion returns per database query
+NOTION_PAGE_SIZE = 100
+
+# Concurrent QuickBooks requests (price lookups and invoice creation)
+QB_MAX_CONCURRENCY = 5
+
+# Pooled keep-alive session for every Notion call, with the shared retry policy
+NOTION_SESSION = create_session(pool_connections=8, pool_maxsize=32)
+
+# Resolved client page names, kept in memory for the run and on disk for a day; each name
+# expires a day after it was resolved, so a renamed client is picked up on the next run after that
+CLIENT_NAME_CACHE_FILE = ".notion_client_cache.json"
+CLIENT_NAME_CACHE_TTL_SECONDS = 24 * 60 * 60
+_CLIENT_NAME_CACHE = {}
+_CLIENT_NAME_RESOLVED_AT = {}
+
+# QuickBooks service prices rarely change, so each is cached on disk for a day
+PRICE_CACHE_FILE = ".qb_price_cache.json"
+PRICE_CACHE_TTL_SECONDS = 24 * 60 * 60
+_PRICE_CACHE = None
+
+
+@lru_cache(maxsize=1)
 def get_notion_headers():
-    """Get headers for Notion API requests."""
+    """Get headers for Notion API requests (built once per process, read-only)."""
     creds = load_credentials()
     notion_token = creds.get('NOTION_TOKEN')
     
     if not notion_token:
         raise ValueError("NOTION_TOKEN not found in credentials.config")
     
-    return {
+    return MappingProxyType({
         'Authorization': f'Bearer {notion_token}',
         'Content-Type': 'application/json',
         'Notion-Version': '2022-06-28'
-    }
+    })
+
+
+def query_notion_database(database_id, query_data, headers):
+    """
+    Query a Notion database, following pagination until every result is fetched.
+    
+    Args:
+        database_id: Notion database ID
+        query_data: Query body (filter, sorts); page_size and start_cursor are added here
+        headers: Notion API headers
+        
+    Returns:
+        List of result pages across all query pages
+    """
+    url = f"https://api.notion.com/v1/databases/{database_id}/query"
+    body = {**query_data, "page_size": NOTION_PAGE_SIZE}
+    results = []
+    
+    while True:
+        NOTION_RATE_LIMITER.acquire()
+        response = NOTION_SESSION.post(url, headers=headers, data=orjson.dumps(body))
+        response.raise_for_status()
+        
+        data = orjson.loads(response.content)
+        results.extend(data.get('results', []))
+        
+        if not data.get('has_more'):
+            return results
+        body['start_cursor'] = data['next_cursor']
 
 
 def fetch_notion_client_data(debug=False):
@@ -49,7 +107,6 @@ def fetch_notion_client_data(debug=False):
     
     # Query the Clients database for Active clients
     database_id = creds.get('NOTION_COMPANIES_DB')
-    url = f"https://api.notion.com/v1/databases/{database_id}/query"
     
     # Filter for Active clients only
     query_data = {
@@ -62,13 +119,10 @@ def fetch_notion_client_data(debug=False):
     }
     
     try:
-        response = requests.post(url, headers=headers, json=query_data)
-        response.raise_for_status()
-        
-        data = response.json()
+        results = query_notion_database(database_id, query_data, headers)
         clients = {}
         
-        for result in data.get('results', []):
+        for result in results:
             properties = result['properties']
             
             # Extract client data from Notion properties
@@ -93,6 +147,7 @@ def fetch_notion_client_data(debug=False):
             retainer_service_ids_str = ','.join(retainer_service_ids)
             
             client_data = {
+                'client_page_id': result['id'],
                 'client_page_url': result['url'],
                 'qb_customer_id': properties.get('QB Customer ID', {}).get('rich_text', [{}])[0].get('plain_text', ''),
                 'monthly_retainer_hours': properties.get('Monthly Retainer Hours', {}).get('number', 0),
@@ -134,8 +189,14 @@ def extract_client_from_title(title_text):
     return None
 
 
-def fetch_notion_time_entries(start_date, end_date, debug=False):
-    """Fetch time entries from Notion Time Tracking database for date range using Notion API."""
+def client_name_from_formula(properties):
+    """Read the optional 'Client Name' formula property, which saves a page lookup per client."""
+    formula = properties.get('Client Name', {}).get('formula') or {}
+    return formula.get('string') or None
+
+
+def query_notion_time_entries(start_date, end_date, debug=False):
+    """Query the Notion Time Tracking database for every entry in a date range (raw pages)."""
     if debug:
         print(f"⏱️  Fetching time entries from {start_date} to {end_date}...")
     
@@ -144,7 +205,6 @@ def fetch_notion_time_entries(start_date, end_date, debug=False):
     
     # Query the Time Tracking database for entries in date range
     database_id = creds.get('NOTION_CLIENT_HOURS_DB')
-    url = f"https://api.notion.com/v1/databases/{database_id}/query"
     
     # Filter by date range
     query_data = {
@@ -167,87 +227,114 @@ def fetch_notion_time_entries(start_date, end_date, debug=False):
     }
     
     try:
-        response = requests.post(url, headers=headers, json=query_data)
-        response.raise_for_status()
+        return query_notion_database(database_id, query_data, headers)
         
-        data = response.json()
-        client_entries = {}
-        
-        for result in data.get('results', []):
-            properties = result['properties']
-            
-            # Extract time entry data
-            date_prop = properties.get('Date', {}).get('date', {})
-            entry_date = date_prop.get('start', '') if date_prop else ''
-            
-            hours_worked = properties.get('Hours', {}).get('number', 0)
-            
-            # Get client name from relation or fallback to title extraction
-            client_relation = properties.get('Client', {}).get('relation', [])
-            if client_relation:
-                # Resolve client name from relation ID
-                client_id = client_relation[0]['id']
-                client_name = resolve_client_name_from_id(client_id, headers, debug)
-            else:
-                # Fallback: extract client name from title
-                title_prop = properties.get('Title', {}).get('title', [])
-                title_text = title_prop[0].get('plain_text', '') if title_prop else ''
-                client_name = extract_client_from_title(title_text)
-                if not client_name:
-                    if debug:
-                        print(f"   Warning: Could not determine client for entry: {title_text}")
-                    continue
-            
-            notes = properties.get('Description', {}).get('rich_text', [{}])[0].get('plain_text', '')
-            
-            # Group by client
-            if client_name not in client_entries:
-                client_entries[client_name] = []
+    except requests.exceptions.RequestException as e:
+        if debug:
+            print(f"   Error fetching time entries: {e}")
+        raise
+
+
+def summarize_time_entries(results, debug=False, known_client_names=None):
+    """
+    Group raw time entry pages by client and total their hours.
+    
+    Args:
+        results: Time entry pages from query_notion_time_entries
+        debug: Print per-client totals and unmatched entries
+        known_client_names: Optional dict of client page ID -> name (e.g. from the Clients
+            query); relations found here need no page lookup
             
-            client_entries[client_name].append({
-                'date': entry_date,
-                'hours': hours_worked,
-                'description': notes
-            })
+    Returns:
+        Dict of client_name -> {'entries': [...], 'total_hours': float}
+    """
+    known_client_names = known_client_names or {}
+    client_totals = {}
+    
+    # Resolve every related client not already known (by formula or the Clients query) once,
+    # concurrently, before walking the entries
+    client_ids = set()
+    for result in results:
+        properties = result['properties']
+        client_relation = properties.get('Client', {}).get('relation', [])
+        if (client_relation and not client_name_from_formula(properties)
+                and client_relation[0]['id'] not in known_client_names):
+            client_ids.add(client_relation[0]['id'])
+    client_names = {**resolve_client_names(client_ids, get_notion_headers(), debug), **known_client_names}
+    
+    for result in results:
+        properties = result['properties']
         
-        # Calculate totals per client
-        client_totals = {}
-        for client_name, entries in client_entries.items():
-            total_hours = sum(entry['hours'] for entry in entries)
-            client_totals[client_name] = {
-                'entries': entries,
-                'total_hours': total_hours
-            }
-            
-            if debug:
-                print(f"   {client_name}: {total_hours} hours ({len(entries)} entries)")
+        # Extract time entry data
+        date_prop = properties.get('Date', {}).get('date', {})
+        entry_date = date_prop.get('start', '') if date_prop else ''
         
-        if debug:
-            print(f"   Found {len(client_totals)} clients with time entries")
+        hours_worked = properties.get('Hours', {}).get('number', 0)
         
-        return client_totals
+        # Get client name from the Client Name formula, the relation, or fallback to title extraction
+        client_relation = properties.get('Client', {}).get('relation', [])
+        formula_name = client_name_from_formula(properties)
+        if formula_name:
+            client_name = formula_name
+        elif client_relation:
+            # Look up the client name resolved from the relation ID
+            client_name = client_names[client_relation[0]['id']]
+        else:
+            # Fallback: extract client name from title
+            title_prop = properties.get('Title', {}).get('title', [])
+            title_text = title_prop[0].get('plain_text', '') if title_prop else ''
+            client_name = extract_client_from_title(title_text)
+            if not client_name:
+                if debug:
+                    print(f"   Warning: Could not determine client for entry: {title_text}")
+                continue
         
-    except requests.exceptions.RequestException as e:
-        if debug:
-            print(f"   Error fetching time entries: {e}")
-        raise
+        notes = properties.get('Description', {}).get('rich_text', [{}])[0].get('plain_text', '')
+        
+        # Group by client, keeping a running total of hours
+        bucket = client_totals.setdefault(client_name, {'entries': [], 'total_hours': 0})
+        bucket['entries'].append({
+            'date': entry_date,
+            'hours': hours_worked,
+            'description': notes
+        })
+        bucket['total_hours'] += hours_worked or 0
+    
+    if debug:
+        for client_name, bucket in client_totals.items():
+            print(f"   {client_name}: {bucket['total_hours']} hours ({len(bucket['entries'])} entries)")
+        print(f"   Found {len(client_totals)} clients with time entries")
+    
+    return client_totals
+
+
+def fetch_notion_time_entries(start_date, end_date, debug=False):
+    """Fetch time entries from Notion Time Tracking database for date range using Notion API."""
+    return summarize_time_entries(query_notion_time_entries(start_date, end_date, debug), debug)
 
 
 def resolve_client_name_from_id(client_id, headers, debug=False):
-    """Resolve client name from Notion page ID."""
+    """Resolve client name from Notion page ID (memoized; unresolved IDs are retried next call)."""
+    if client_id in _CLIENT_NAME_CACHE:
+        return _CLIENT_NAME_CACHE[client_id]
+    
     url = f"https://api.notion.com/v1/pages/{client_id}"
     
     try:
-        response = requests.get(url, headers=headers)
+        NOTION_RATE_LIMITER.acquire()
+        response = NOTION_SESSION.get(url, headers=headers)
         response.raise_for_status()
         
-        data = response.json()
+        data = orjson.loads(response.content)
         properties = data.get('properties', {})
         
         # Get the Name property (title)
         name_prop = properties.get('Name', {}).get('title', [])
         if name_prop:
-            return name_prop[0].get('plain_text', 'Unknown')
+            name = name_prop[0].get('plain_text', 'Unknown')
+            _CLIENT_NAME_CACHE[client_id] = name
+            _CLIENT_NAME_RESOLVED_AT[client_id] = time.time()
+            return name
         
         return 'Unknown'
         
@@ -257,6 +344,63 @@ def resolve_client_name_from_id(client_id, headers, debug=False):
         return 'Unknown'
 
 
+def resolve_client_names(client_ids, headers, debug=False):
+    """
+    Resolve many Notion client page IDs to names concurrently.
+    
+    Args:
+        client_ids: Unique Notion page IDs to resolve
+        headers: Notion API headers
+        debug: Print warnings for pages that cannot be resolved
+        
+    Returns:
+        Dict of page ID -> client name ('Unknown' if unresolvable)
+    """
+    if not _CLIENT_NAME_CACHE:
+        for client_id, entry in load_client_name_cache().items():
+            _CLIENT_NAME_CACHE[client_id] = entry['name']
+            _CLIENT_NAME_RESOLVED_AT[client_id] = entry['ts']
+    
+    missing = [client_id for client_id in client_ids if client_id not in _CLIENT_NAME_CACHE]
+    if missing:
+        # Lookups overlap network latency; NOTION_RATE_LIMITER keeps the overall rate within Notion's limit
+        with ThreadPoolExecutor(max_workers=min(NOTION_MAX_CONCURRENCY, len(missing))) as executor:
+            list(executor.map(lambda client_id: resolve_client_name_from_id(client_id, headers, debug), missing))
+        save_client_name_cache({
+            client_id: {'name': name, 'ts': _CLIENT_NAME_RESOLVED_AT[client_id]}
+            for client_id, name in _CLIENT_NAME_CACHE.items()
+        })
+    
+    return {client_id: _CLIENT_NAME_CACHE.get(client_id, 'Unknown') for client_id in client_ids}
+
+
+def load_client_name_cache():
+    """
+    Load resolved client names (page ID -> name and timestamp) saved by earlier runs.
+    Entries older than a day, or in an unrecognized format, are dropped individually;
+    returns {} if the file is missing or corrupt.
+    """
+    try:
+        with open(CLIENT_NAME_CACHE_FILE, 'r') as f:
+            entries = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    
+    now = time.time()
+    return {
+        client_id: entry for client_id, entry in entries.items()
+        if isinstance(entry, dict) and now - entry.get('ts', 0) < CLIENT_NAME_CACHE_TTL_SECONDS
+    }
+
+
+def save_client_name_cache(names):
+    """Save resolved client names (page ID -> name and timestamp) atomically for the next run."""
+    tmp_file = f"{CLIENT_NAME_CACHE_FILE}.tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(names, f, indent=2)
+    os.replace(tmp_file, CLIENT_NAME_CACHE_FILE)
+
+
 def calculate_client_billing_data(clients_config, time_data, debug=False):
     """Calculate billing data by combining client config with actual time entries."""
     if debug:
@@ -267,23 +411,24 @@ def calculate_client_billing_data(clients_config, time_data, debug=False):
     for client_name, config in clients_config.items():
         time_info = time_data.get(client_name, {'entries': [], 'total_hours': 0})
         
-        # Calculate overages
+        # Calculate overages from one signed difference: positive is overage, negative is unused retainer
         actual_hours = time_info['total_hours']
         retainer_hours = config['monthly_retainer_hours']
-        overage_hours = max(0, actual_hours - retainer_hours)
-        overage_amount = overage_hours * config['overage_rate']
+        hours_delta = actual_hours - retainer_hours
+        overage_hours = max(0, hours_delta)
+        under_retainer_hours = max(0, -hours_delta)
         
-        billing_data[client_name] = {
-            **config,  # Include all client config
+        # Layer the derived fields over the client config without copying it
+        billing_data[client_name] = ChainMap({
             'time_entries': time_info['entries'],
             'actual_hours': actual_hours,
             'overage_hours': overage_hours,
-            'overage_amount': overage_amount,
-            'under_retainer_hours': max(0, retainer_hours - actual_hours) if actual_hours < retainer_hours else 0
-        }
+            'overage_amount': overage_hours * config['overage_rate'],
+            'under_retainer_hours': under_retainer_hours
+        }, config)
         
         if debug:
-            status = "OVERAGE" if overage_hours > 0 else "UNDER" if actual_hours < retainer_hours else "EXACT"
+            status = "OVERAGE" if overage_hours > 0 else "UNDER" if under_retainer_hours > 0 else "EXACT"
             print(f"   {client_name}: {actual_hours}hrs actual vs {retainer_hours}hrs retainer → {status}")
     
     return billing_data
@@ -295,11 +440,16 @@ def get_client_data_from_notion(start_date, end_date, debug=False):
         print(f"\\n📊 FETCHING DATA FROM NOTION")
         print(f"   Date range: {start_date} to {end_date}")
     
-    # Step 1: Get client configuration 
-    clients_config = fetch_notion_client_data(debug)
+    # Steps 1 and 2 are independent, so query client configuration and time entries concurrently
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        clients_future = executor.submit(fetch_notion_client_data, debug)
+        time_future = executor.submit(query_notion_time_entries, start_date, end_date, debug)
+        clients_config = clients_future.result()
+        time_results = time_future.result()
     
-    # Step 2: Get time entries for date range
-    time_data = fetch_notion_time_entries(start_date, end_date, debug)
+    # Client relations point at the pages just fetched, so name them locally instead of per-page GETs
+    page_names = {config['client_page_id']: name for name, config in clients_config.items()}
+    time_data = summarize_time_entries(time_results, debug, known_client_names=page_names)
     
     # Step 3: Calculate billing data
     billing_data = calculate_client_billing_data(clients_config, time_data, debug)
@@ -310,73 +460,76 @@ def get_client_data_from_notion(start_date, end_date, debug=False):
     return billing_data
 
 
+def format_client_debug_info(client_name, data):
+    """Format one client's debug breakdown; returns (lines, invoice_total)."""
+    lines = [f"\\n🏢 {client_name.upper()}", "-" * 60]
+    
+    # Client configuration
+    lines.append("📋 CLIENT CONFIGURATION:")
+    lines.append(f"   Monthly Retainer Hours: {data['monthly_retainer_hours']} hrs")
+    lines.append(f"   Retainer Rate: ${data['retainer_rate']:,.2f}/month")
+    lines.append(f"   Overage Rate: ${data['overage_rate']}/hr")
+    lines.append(f"   QB Customer ID: {data['qb_customer_id']}")
+    
+    # Fixed services
+    lines.append("\\n🛍️  FIXED SERVICES:")
+    total_services = 0
+    for service_name, service_data in data['services'].items():
+        lines.append(f"   • {service_name}: ${service_data['amount']:,} (QB ID: {service_data['qb_id']})")
+        total_services += service_data['amount']
+    
+    # Time tracking data
+    lines.append(f"\\n⏱️  TIME ENTRIES:")
+    if data['time_entries']:
+        for entry in data['time_entries']:
+            lines.append(f"   {entry['date']}: {entry['hours']} hrs - {entry['description']}")
+        lines.append(f"   {'─' * 50}")
+        lines.append(f"   TOTAL: {data['actual_hours']} hrs")
+    else:
+        lines.append(f"   Total hours: {data['actual_hours']} hrs (no detailed entries)")
+        
+    # Overage calculations
+    lines.append(f"\\n💰 OVERAGE CALCULATION:")
+    lines.append(f"   Retainer allocation: {data['monthly_retainer_hours']} hrs")
+    lines.append(f"   Actual hours worked: {data['actual_hours']} hrs")
+    
+    if data['overage_hours'] > 0:
+        lines.append(f"   ✅ OVERAGE: {data['overage_hours']} hrs")
+        lines.append(f"   Overage calculation: {data['overage_hours']} × ${data['overage_rate']} = ${data['overage_amount']:,.2f}")
+    elif data['under_retainer_hours'] > 0:
+        lines.append(f"   ⬇️  UNDER RETAINER: {data['under_retainer_hours']} hrs unused")
+        lines.append(f"   Overage amount: $0")
+    else:
+        lines.append(f"   ✅ EXACT MATCH: Used exactly {data['monthly_retainer_hours']} hrs")
+        lines.append(f"   Overage amount: $0")
+        
+    # Expected invoice
+    lines.append(f"\\n🧾 EXPECTED INVOICE:")
+    for service_name, service_data in data['services'].items():
+        lines.append(f"   • {service_name}: ${service_data['amount']:,}")
+    
+    if data['overage_amount'] > 0:
+        lines.append(f"   • Hourly Overages: ${data['overage_amount']:,} ({data['overage_hours']} hrs)")
+        
+    invoice_total = total_services + data['overage_amount']
+    lines.append(f"   {'─' * 50}")
+    lines.append(f"   CLIENT TOTAL: ${invoice_total:,}")
+    return lines, invoice_total
+
+
 def print_client_debug_info(clients):
-    """Print detailed debug information for each client."""
-    print(f"\\n" + "=" * 100)
-    print("🔍 DETAILED CLIENT DEBUG BREAKDOWN")
-    print("=" * 100)
+    """Print detailed debug information for each client (buffered into a single write)."""
+    lines = [f"\\n" + "=" * 100, "🔍 DETAILED CLIENT DEBUG BREAKDOWN", "=" * 100]
     
     grand_total = 0
     
     for client_name, data in clients.items():
-        print(f"\\n🏢 {client_name.upper()}")
-        print("-" * 60)
-        
-        # Client configuration
-        print("📋 CLIENT CONFIGURATION:")
-        print(f"   Monthly Retainer Hours: {data['monthly_retainer_hours']} hrs")
-        print(f"   Retainer Rate: ${data['retainer_rate']:,.2f}/month")
-        print(f"   Overage Rate: ${data['overage_rate']}/hr")
-        print(f"   QB Customer ID: {data['qb_customer_id']}")
-        
-        # Fixed services
-        print("\\n🛍️  FIXED SERVICES:")
-        total_services = 0
-        for service_name, service_data in data['services'].items():
-            print(f"   • {service_name}: ${service_data['amount']:,} (QB ID: {service_data['qb_id']})")
-            total_services += service_data['amount']
-        
-        # Time tracking data
-        print(f"\\n⏱️  TIME ENTRIES:")
-        if data['time_entries']:
-            for entry in data['time_entries']:
-                print(f"   {entry['date']}: {entry['hours']} hrs - {entry['description']}")
-            print(f"   {'─' * 50}")
-            print(f"   TOTAL: {data['actual_hours']} hrs")
-        else:
-            print(f"   Total hours: {data['actual_hours']} hrs (no detailed entries)")
-            
-        # Overage calculations
-        print(f"\\n💰 OVERAGE CALCULATION:")
-        print(f"   Retainer allocation: {data['monthly_retainer_hours']} hrs")
-        print(f"   Actual hours worked: {data['actual_hours']} hrs")
-        
-        if data['overage_hours'] > 0:
-            print(f"   ✅ OVERAGE: {data['overage_hours']} hrs")
-            print(f"   Overage calculation: {data['overage_hours']} × ${data['overage_rate']} = ${data['overage_amount']:,.2f}")
-        elif data['under_retainer_hours'] > 0:
-            print(f"   ⬇️  UNDER RETAINER: {data['under_retainer_hours']} hrs unused")
-            print(f"   Overage amount: $0")
-        else:
-            print(f"   ✅ EXACT MATCH: Used exactly {data['monthly_retainer_hours']} hrs")
-            print(f"   Overage amount: $0")
-            
-        # Expected invoice
-        print(f"\\n🧾 EXPECTED INVOICE:")
-        for service_name, service_data in data['services'].items():
-            print(f"   • {service_name}: ${service_data['amount']:,}")
-        
-        if data['overage_amount'] > 0:
-            print(f"   • Hourly Overages: ${data['overage_amount']:,} ({data['overage_hours']} hrs)")
-            
-        invoice_total = total_services + data['overage_amount']
-        print(f"   {'─' * 50}")
-        print(f"   CLIENT TOTAL: ${invoice_total:,}")
+        client_lines, invoice_total = format_client_debug_info(client_name, data)
+        lines += client_lines
         grand_total += invoice_total
     
-    print(f"\\n" + "=" * 100)
-    print(f"💰 GRAND TOTAL ALL CLIENTS: ${grand_total:,}")
-    print("=" * 100)
+    lines += [f"\\n" + "=" * 100, f"💰 GRAND TOTAL ALL CLIENTS: ${grand_total:,}", "=" * 100]
+    sys.stdout.write("\n".join(lines) + "\n")
 
 
 def create_invoice_prep_records(time_data, overage_month, bill_month, invoice_date):
@@ -421,7 +574,9 @@ def create_invoice_prep_records(time_data, overage_month, bill_month, invoice_da
                 "properties": {
                     "Title": f"{client_name} {overage_month} Overage", 
                     "Client": f'["{data["client_page_url"]}"]',
-                    "Client Hours": json.dumps(data['time_entries']),  # JSON array of time entry URLs
+                    # Compact JSON array of the billed entries (date and hours only)
+                    "Client Hours": orjson.dumps([{'date': e['date'], 'hours': e['hours']}
+                                                  for e in data['time_entries']]).decode(),
                     "Billing Month": overage_month,
                     "Billing Type": "Previous Overage",
                     "date:Invoice Date:start": invoice_date,
@@ -448,11 +603,13 @@ def convert_client_data_to_prep_records(client_data, bill_month, overage_month):
     """
     prep_records = []
     
+    # Convert YYYY-MM to "Month YYYY" format for descriptions (same for every client)
+    bill_month_formatted = datetime.strptime(bill_month + '-01', '%Y-%m-%d').strftime('%B %Y')
+    overage_month_formatted = datetime.strptime(overage_month + '-01', '%Y-%m-%d').strftime('%B %Y')
+    
     for client_name, data in client_data.items():
         # Add retainer services
         for service_name, service_info in data.get('services', {}).items():
-            # Convert YYYY-MM to "Month YYYY" format for description
-            bill_month_formatted = datetime.strptime(bill_month + '-01', '%Y-%m-%d').strftime('%B %Y')
             prep_records.append({
                 'title': f'{client_name} {bill_month} {service_name}',
                 'client': client_name,
@@ -464,8 +621,6 @@ def convert_client_data_to_prep_records(client_data, bill_month, overage_month):
         
         # Add overage if client exceeded retainer hours
         if data.get('overage_amount', 0) > 0:
-            # Convert YYYY-MM to "Month YYYY" format for description
-            overage_month_formatted = datetime.strptime(overage_month + '-01', '%Y-%m-%d').strftime('%B %Y')
             prep_records.append({
                 'title': f'{client_name} {overage_month} Overage',
                 'client': client_name,
@@ -495,15 +650,19 @@ def group_by_client_for_invoicing(prep_data):
     return client_invoices
 
 
-def fetch_qb_service_price(service_id, auth_manager):
-    """Fetch service price from QuickBooks API."""
-    realm_id = auth_manager.credentials.get('INTUIT_REALM_ID')
-    url = f"{auth_manager.base_url}/v3/company/{realm_id}/item/{service_id}"
+def qb_company_url(auth_manager):
+    """Build the QuickBooks company API prefix once, e.g. https://.../v3/company/<realm>."""
+    return f"{auth_manager.base_url}/v3/company/{auth_manager.credentials.get('INTUIT_REALM_ID')}"
+
+
+def fetch_qb_service_price(service_id, auth_manager, company_url):
+    """Fetch service price from QuickBooks API (company_url from qb_company_url)."""
+    url = f"{company_url}/item/{service_id}"
     
     try:
         response = auth_manager.make_authenticated_request('GET', url)
         if response and response.status_code == 200:
-            data = response.json()
+            data = orjson.loads(response.content)
             item = data.get('Item', {})
             return item.get('UnitPrice', 0)
         else:
@@ -516,10 +675,81 @@ def fetch_qb_service_price(service_id, auth_manager):
         return 0
 
 
-def create_qb_invoice_from_prep(client_name, client_data, auth_manager, invoice_date, due_date):
-    """Create QuickBooks invoice from Monthly Invoice Prep data."""
-    realm_id = auth_manager.credentials.get('INTUIT_REALM_ID')
+def fetch_qb_service_prices(service_ids, auth_manager, company_url, refresh=False):
+    """
+    Fetch prices for several QuickBooks services, returning service ID -> price.
+    Prices fetched within the last day are served from the on-disk price cache (keyed by
+    item URL, so sandbox and production never mix) unless refresh is set; the rest are
+    fetched concurrently.
+    """
+    cache = load_price_cache()
+    now = time.time()
+    
+    prices = {}
+    missing = []
+    for service_id in service_ids:
+        entry = cache.get(f"{company_url}/item/{service_id}")
+        if entry and not refresh and now - entry['ts'] < PRICE_CACHE_TTL_SECONDS:
+            prices[service_id] = entry['price']
+        else:
+            missing.append(service_id)
+    
+    if not missing:
+        return prices
+    
+    with ThreadPoolExecutor(max_workers=min(QB_MAX_CONCURRENCY, len(missing))) as executor:
+        fetched = executor.map(lambda service_id: fetch_qb_service_price(service_id, auth_manager, company_url),
+                               missing)
+        for service_id, price in zip(missing, fetched):
+            prices[service_id] = price
+            # Failed lookups return 0 and are not cached, so they are retried next run
+            if price > 0:
+                cache[f"{company_url}/item/{service_id}"] = {'price': price, 'ts': now}
     
+    save_price_cache(cache)
+    return prices
+
+
+def load_price_cache():
+    """Load cached service prices (item URL -> price and timestamp), or {} if unreadable."""
+    global _PRICE_CACHE
+    if _PRICE_CACHE is None:
+        try:
+            with open(PRICE_CACHE_FILE, 'r') as f:
+                _PRICE_CACHE = json.load(f)
+        except (OSError, ValueError):
+            _PRICE_CACHE = {}
+    return _PRICE_CACHE
+
+
+def save_price_cache(cache):
+    """Save service prices atomically for the next run."""
+    tmp_file = f"{PRICE_CACHE_FILE}.tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp_file, PRICE_CACHE_FILE)
+
+
+def invoice_service_ids(client_data):
+    """QuickBooks service IDs whose prices are needed for a client's retainer lines."""
+    return {item.get('qb_service_id', '1') for item in client_data['line_items']
+            if item['billing_type'] != 'Previous Overage'}
+
+
+def build_prep_invoice(client_name, client_data, invoice_date, due_date, prices):
+    """
+    Build the QuickBooks invoice payload for a client's prep data.
+    
+    Args:
+        client_name: Client name (its initial goes into the invoice number)
+        client_data: Grouped prep data from group_by_client_for_invoicing
+        invoice_date: Invoice date (YYYY-MM-DD)
+        due_date: Due date (YYYY-MM-DD)
+        prices: Dict of QB service ID -> price from fetch_qb_service_prices
+        
+    Returns:
+        Tuple of (invoice_data, total_amount)
+    """
     # Convert prep data to QB line items
     line_items = []
     for item in client_data['line_items']:
@@ -541,7 +771,7 @@ def create_qb_invoice_from_prep(client_name, client_data, auth_manager, invoice_
             line_item['SalesItemLineDetail']['UnitPrice'] = item['invoice_amount']
         else:
             # For retainer services, fetch price from QuickBooks
-            service_price = fetch_qb_service_price(qb_item_id, auth_manager)
+            service_price = prices.get(qb_item_id, 0)
             if service_price > 0:
                 line_item['Amount'] = service_price
                 line_item['SalesItemLineDetail']['UnitPrice'] = service_price
@@ -573,42 +803,99 @@ def create_qb_invoice_from_prep(client_name, client_data, auth_manager, invoice_
         'ShipMethodRef': None  # Disable shipping method
     }
     
-    url = f"{auth_manager.base_url}/v3/company/{realm_id}/invoice"
+    return invoice_data, total_amount
+
+
+def format_prep_invoice_lines(client_name, client_data, invoice_data, total_amount):
+    """Output lines describing the invoice about to be created for a client."""
+    lines = [
+        f"\\n📧 Creating consolidated invoice for {client_name}...",
+        f"   Customer ID: {client_data['client_id']}",
+        f"   Line Items:"
+    ]
+    for i, item in enumerate(client_data['line_items'], 1):
+        amount_str = f"${item['invoice_amount']}" if 'invoice_amount' in item else "QB will set amount"
+        lines.append(f"     {i}. {item['invoice_description']}: {amount_str}")
+    lines.append(f"   Total Amount: ${total_amount}")
+    lines.append(f"   Custom Invoice Number: {invoice_data['DocNumber']}")
+    return lines
+
+
+def create_qb_invoices_batch(client_invoices, auth_manager, company_url, invoice_date, due_date, prices):
+    """
+    Create invoices through the QuickBooks batch endpoint, up to BATCH_LIMIT per request, with
+    the batch requests sent concurrently. A batch that fails outright is reported as failed for
+    each of its invoices and never re-posted, since QuickBooks may already have created them.
     
-    try:
-        print(f"\\n📧 Creating consolidated invoice for {client_name}...")
-        print(f"   Customer ID: {client_data['client_id']}")
-        print(f"   Line Items:")
-        for i, item in enumerate(client_data['line_items'], 1):
-            amount_str = f"${item['invoice_amount']}" if 'invoice_amount' in item else "QB will set amount"
-            print(f"     {i}. {item['invoice_description']}: {amount_str}")
-        print(f"   Total Amount: ${total_amount}")
-        print(f"   Custom Invoice Number: {custom_invoice_num}")
+    Args:
+        client_invoices: Dict of client_name -> grouped prep data
+        auth_manager: QuickBooksAuthManager for the target company
+        company_url: Company API prefix from qb_company_url
+        invoice_date: Invoice date (YYYY-MM-DD)
+        due_date: Due date (YYYY-MM-DD)
+        prices: Dict of QB service ID -> price for every client's services
         
-        response = auth_manager.make_authenticated_request('POST', url, json=invoice_data)
+    Returns:
+        Dict of client_name -> result: {'success', 'invoice_id', 'invoice_number', 'total_amount'}
+        on success, or {'success': False, 'error'}
+    """
+    invoices = {
+        client_name: build_prep_invoice(client_name, client_data, invoice_date, due_date, prices)
+        for client_name, client_data in client_invoices.items()
+    }
+    client_names = list(invoices)
+    chunks = [client_names[start:start + BATCH_LIMIT] for start in range(0, len(client_names), BATCH_LIMIT)]
+    url = f"{company_url}/batch"
+    
+    def submit_chunk(chunk):
+        batch_items = [{'bId': str(i), 'operation': 'create', 'Invoice': invoices[name][0]}
+                       for i, name in enumerate(chunk)]
+        # Idempotency key so retries of this POST cannot create duplicate invoices
+        return auth_manager.make_authenticated_request('POST', url, json={'BatchItemRequest': batch_items},
+                                                       params={'requestid': uuid.uuid4().hex})
+    
+    print(f"📧 Creating {len(client_names)} invoices in {len(chunks)} batch request(s)...")
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(QB_MAX_CONCURRENCY, len(chunks)))) as executor:
+        chunk_responses = list(executor.map(submit_chunk, chunks))
+    
+    results = {}
+    for chunk, response in zip(chunks, chunk_responses):
+        if response is None or response.status_code != 200:
+            # No per-invoice fallback: QuickBooks may already have committed the batch (e.g. a read
+            # timeout after the write), so re-posting could create duplicate invoices
+            status = response.status_code if response is not None else "No response"
+            error = f"Batch request failed ({status}) - check QuickBooks before re-running"
+            print(f"   ❌ {error}: {', '.join(chunk)}")
+            for name in chunk:
+                results[name] = {'success': False, 'error': error}
+            continue
         
-        if response and response.status_code == 200:
-            result = response.json()
-            invoice = result['Invoice']
-            invoice_id = invoice['Id']
-            invoice_num = invoice.get('DocNumber', custom_invoice_num)  # Use our custom number
-            print(f"   ✅ Invoice created: #{invoice_num} (QB ID: {invoice_id})")
-            return {
-                'success': True,
-                'invoice_id': invoice_id,
-                'invoice_number': invoice_num,
-                'total_amount': total_amount
-            }
-        else:
-            status = response.status_code if response else "No response"
-            error_text = response.text if response else "Connection failed"
-            print(f"   ❌ Error: {status}")
-            print(f"   Response: {error_text}")
-            return {'success': False, 'error': error_text}
+        responses = {item['bId']: item for item in orjson.loads(response.content).get('BatchItemResponse', [])}
+        lines = []
+        for i, name in enumerate(chunk):
+            invoice_data, total_amount = invoices[name]
+            lines += format_prep_invoice_lines(name, client_invoices[name], invoice_data, total_amount)
+            item = responses.get(str(i), {})
             
-    except Exception as e:
-        print(f"   ❌ Exception: {e}")
-        return {'success': False, 'error': str(e)}
+            if 'Invoice' in item:
+                invoice = item['Invoice']
+                invoice_num = invoice.get('DocNumber', invoice_data['DocNumber'])
+                lines.append(f"   ✅ Invoice created: #{invoice_num} (QB ID: {invoice['Id']})")
+                results[name] = {
+                    'success': True,
+                    'invoice_id': invoice['Id'],
+                    'invoice_number': invoice_num,
+                    'total_amount': total_amount
+                }
+            else:
+                error = orjson.dumps(item.get('Fault', 'No response for batch item')).decode()
+                lines.append(f"   ❌ Error: {error}")
+                results[name] = {'success': False, 'error': error}
+        
+        sys.stdout.write("\n".join(lines) + "\n")
+    
+    return results
 
 
 def parse_arguments():
@@ -643,6 +930,8 @@ Examples:
                        help='Show detailed breakdown of client data and calculations')
     parser.add_argument('--production', action='store_true',
                        help='Use production QuickBooks environment (default: sandbox)')
+    parser.add_argument('--refresh-prices', action='store_true',
+                       help='Ignore cached QuickBooks service prices and refetch them')
     
     return parser.parse_args()
 
@@ -677,7 +966,8 @@ def validate_date_inputs(args):
             'invoice_date': invoice_date.strftime('%Y-%m-%d'),
             'dry_run': args.dry_run,
             'debug': args.debug,
-            'production': args.production
+            'production': args.production,
+            'refresh_prices': args.refresh_prices
         }
         
     except ValueError as e:
@@ -756,22 +1046,27 @@ def main():
         # Simulate results for dry run
         import datetime as dt
         invoice_date_obj = dt.datetime.strptime(dates['invoice_date'], '%Y-%m-%d')
+        invoice_num_prefix = f"{invoice_date_obj.year}-{invoice_date_obj.strftime('%m%d')}"
         
-        for client_name in client_invoices.keys():
+        dry_run_lines = []
+        for client_name, invoice_data in client_invoices.items():
             # Generate what the custom invoice number would be
-            client_initial = client_name[0].upper()
-            unique_suffix = str(invoice_date_obj.strftime('%m%d'))
-            custom_invoice_num = f"{invoice_date_obj.year}-{unique_suffix}{client_initial}"
+            custom_invoice_num = f"{invoice_num_prefix}{client_name[0].upper()}"
+            line_items = invoice_data['line_items']
             
-            total_amount = sum(item.get('invoice_amount', 0) for item in client_invoices[client_name]['line_items'])
+            total_amount = sum(item.get('invoice_amount', 0) for item in line_items)
             results[client_name] = {
                 'success': True,
                 'invoice_number': custom_invoice_num,
                 'total_amount': total_amount
             }
-            print(f"   🔍 Would create invoice for {client_name}: #{custom_invoice_num} - ${total_amount}")
-            print(f"       Line items: {len(client_invoices[client_name]['line_items'])}")
-            print(f"       Ship-to field: DISABLED")
+            dry_run_lines += [
+                f"   🔍 Would create invoice for {client_name}: #{custom_invoice_num} - ${total_amount}",
+                f"       Line items: {len(line_items)}",
+                f"       Ship-to field: DISABLED"
+            ]
+        if dry_run_lines:
+            sys.stdout.write("\n".join(dry_run_lines) + "\n")
     else:
         # Calculate due date (30 days after invoice date)
         from datetime import datetime, timedelta
@@ -779,50 +1074,59 @@ def main():
         due_date_obj = invoice_date_obj + timedelta(days=30)
         due_date = due_date_obj.strftime('%Y-%m-%d')
         
-        for client_name, client_data in client_invoices.items():
-            result = create_qb_invoice_from_prep(client_name, client_data, auth_manager, dates['invoice_date'], due_date)
-            results[client_name] = result
+        company_url = qb_company_url(auth_manager)
+        
+        # Fetch every service price once for the whole run, then create the invoices in batches
+        service_ids = set()
+        for client_data in client_invoices.values():
+            service_ids |= invoice_service_ids(client_data)
+        prices = fetch_qb_service_prices(service_ids, auth_manager, company_url, refresh=dates['refresh_prices'])
+        
+        results = create_qb_invoices_batch(client_invoices, auth_manager, company_url,
+                                           dates['invoice_date'], due_date, prices)
     
-    # Summary
-    print(f"\\n" + "=" * 80)
-    print("📊 FINAL SUMMARY")
-    print("=" * 80)
+    # Summary (built up and written in one go)
+    lines = [f"\\n" + "=" * 80, "📊 FINAL SUMMARY", "=" * 80]
     
     successful = 0
     total_amount = 0
     
     for client_name, result in results.items():
         if result['success']:
+            amount = result['total_amount']
             successful += 1
-            total_amount += result['total_amount']
+            total_amount += amount
             if dates['dry_run']:
-                print(f"🔍 {client_name}: Would invoice ${result['total_amount']}")
+                lines.append(f"🔍 {client_name}: Would invoice ${amount}")
             else:
-                print(f"✅ {client_name}: Invoice #{result['invoice_number']} - ${result['total_amount']}")
+                lines.append(f"✅ {client_name}: Invoice #{result['invoice_number']} - ${amount}")
         else:
-            print(f"❌ {client_name}: Failed - {result.get('error', 'Unknown error')}")
+            lines.append(f"❌ {client_name}: Failed - {result.get('error', 'Unknown error')}")
     
-    print(f"\\n🎯 Results: {successful}/{len(results)} invoices {'would be created' if dates['dry_run'] else 'created'}")
-    print(f"💰 Total {'potential' if dates['dry_run'] else ''} amount: ${total_amount}")
-    print(f"📝 Invoice prep records: {len(prep_records)}")
+    lines.append(f"\\n🎯 Results: {successful}/{len(results)} invoices {'would be created' if dates['dry_run'] else 'created'}")
+    lines.append(f"💰 Total {'potential' if dates['dry_run'] else ''} amount: ${total_amount}")
+    lines.append(f"📝 Invoice prep records: {len(prep_records)}")
     
-    if successful == len(results):
+    all_successful = successful == len(results)
+    if all_successful:
         if dates['dry_run']:
-            print("\\n🔍 Dry run completed successfully!")
-            print("💡 Run without --dry-run to create actual QuickBooks invoices")
+            lines.append("\\n🔍 Dry run completed successfully!")
+            lines.append("💡 Run without --dry-run to create actual QuickBooks invoices")
         else:
-            print("\\n🎉 Complete workflow successful!")
-            print("💡 Next steps:")
-            print("   1. Review draft invoices in QuickBooks sandbox")
-            print("   2. Implement real Notion API calls to create prep records")
-            print("   3. Set up n8n automation for monthly execution")
+            lines += [
+                "\\n🎉 Complete workflow successful!",
+                "💡 Next steps:",
+                "   1. Review draft invoices in QuickBooks sandbox",
+                "   2. Implement real Notion API calls to create prep records",
+                "   3. Set up n8n automation for monthly execution"
+            ]
     else:
-        print("\\n❌ Some invoices failed to create.")
-        print("\\n🆘 SUPPORT INFORMATION:")
-        print(auth_manager.get_support_info())
-        return 1
-        
-    return 0
+        lines.append("\\n❌ Some invoices failed to create.")
+        lines.append("\\n🆘 SUPPORT INFORMATION:")
+        lines.append(auth_manager.get_support_info())
+    
+    sys.stdout.write("\n".join(lines) + "\n")
+    return 0 if all_successful else 1
 
 
 if __name__ == "__main__":
@@ -5,12 +5,102 @@ Handles token refresh, validation, and retry logic for QuickBooks API calls
 """
 
 import os
+import sys
+import base64
+import logging
+import stat
 import requests
 import json
 import time
-from datetime import datetime, timedelta
+import random
+import threading
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 from typing import Dict, Optional, Tuple, Any
 from qb_error_handler import QuickBooksErrorHandler
+from qb_http import create_session
+
+
+# Console output for the CLI scripts: plain messages on stdout, as print() gave before.
+# Callers running under a scheduler can raise the level or swap the handler.
+logger = logging.getLogger(__name__)
+if not logger.handlers:
+    _console_handler = logging.StreamHandler(sys.stdout)
+    _console_handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_console_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+# Access tokens last an hour; treat them as expired 5 minutes early
+TOKEN_LIFETIME = timedelta(minutes=55)
+
+# (connect, read) timeouts for the token endpoint, so a hung refresh can't stall a run
+TOKEN_REQUEST_TIMEOUT = (3.05, 10)
+
+# QuickBooks throttles each realm per minute; requests are paced below these limits client-side
+REQUESTS_PER_MINUTE = {"sandbox": 100, "production": 500}
+
+# Ceiling for the exponential retry backoff
+MAX_BACKOFF_SECONDS = 60
+
+# A successful API call this recent stands in for a validate_connection round-trip
+VALIDATION_FRESH_SECONDS = 300
+
+
+class TokenBucket:
+    """Thread-safe token bucket that paces requests to a steady rate."""
+    
+    def __init__(self, capacity: float, refill_rate_per_sec: float):
+        self.capacity = capacity
+        self.tokens = capacity
+        self.refill_rate_per_sec = refill_rate_per_sec
+        self.last_refill = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """Take one token, sleeping until one is available."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.refill_rate_per_sec)
+            self.last_refill = now
+            
+            # Reserve the token now so concurrent callers queue up behind each other
+            self.tokens -= 1
+            wait = -self.tokens / self.refill_rate_per_sec if self.tokens < 0 else 0
+        
+        if wait:
+            time.sleep(wait)
+
+
+def _backoff_delay(attempt: int) -> float:
+    """Exponential backoff with jitter, so parallel workers don't retry in lockstep."""
+    return min(MAX_BACKOFF_SECONDS, 2 ** attempt + random.random())
+
+
+def _retry_after_seconds(response: requests.Response) -> Optional[float]:
+    """Parse a Retry-After header given either as seconds or as an HTTP date."""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def _create_rate_limiter(environment: str) -> TokenBucket:
+    """Build the request limiter for an environment's per-minute throttle."""
+    per_minute = REQUESTS_PER_MINUTE.get(environment, REQUESTS_PER_MINUTE["sandbox"])
+    return TokenBucket(capacity=per_minute, refill_rate_per_sec=per_minute / 60)
 
 
 class QuickBooksAuthManager:
@@ -37,6 +127,31 @@ class QuickBooksAuthManager:
         
         self.credentials = self._load_credentials()
         
+        # Client ID and secret don't change for the life of the manager, so encode them once
+        client_id = self.credentials.get('INTUIT_CLIENT_ID')
+        client_secret = self.credentials.get('INTUIT_CLIENT_SECRET')
+        self._basic_auth_header: Optional[str] = None
+        if client_id and client_secret:
+            self._basic_auth_header = 'Basic ' + base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
+        
+        # Token endpoint headers are the same for every refresh
+        self._refresh_headers = {
+            'Accept': 'application/json',
+            'Authorization': self._basic_auth_header,
+            'Content-Type': 'application/x-www-form-urlencoded'
+        }
+        
+        # Keys changed since the credentials file was last written
+        self._dirty_keys = set()
+        
+        # Token expiry (on the monotonic clock) and the auth headers built from the current token,
+        # both reset on refresh
+        self._expiry_monotonic: Optional[float] = self._parse_token_expiry()
+        self._cached_headers: Optional[Dict[str, str]] = None
+        
+        # Serializes token refreshes when requests are made from several threads
+        self._refresh_lock = threading.Lock()
+        
         # Set base URL based on environment
         if self.environment == "production":
             self.base_url = "https://quickbooks.api.intuit.com"
@@ -46,38 +161,78 @@ class QuickBooksAuthManager:
         self.token_endpoint = "https://oauth.platform.intuit.com/oauth2/v1/tokens/bearer"
         self.error_handler = QuickBooksErrorHandler(f"qb_api_{self.environment}.log")
         
+        # Pooled keep-alive connections; retries stay in make_authenticated_request, so the adapter has none
+        self._session = create_session(pool_connections=4, pool_maxsize=16, max_retries=0)
+        
+        # time.monotonic() of the last 2xx response (None until one arrives), used to skip
+        # redundant connection checks
+        self._last_success_monotonic: Optional[float] = None
+        
+        # Retries per request after the first attempt; callers may override
+        self._max_retries = 2
+        
+        # Proactive pacing so bulk runs stay under the QuickBooks throttle instead of hitting 429s
+        self._bucket = _create_rate_limiter(self.environment)
+        
     def _load_credentials(self) -> Dict[str, str]:
         """Load credentials from config file."""
         credentials = {}
         if not os.path.exists(self.credentials_file):
             raise FileNotFoundError(f"Credentials file not found: {self.credentials_file}")
             
-        with open(self.credentials_file, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if '=' in line and not line.startswith('#'):
-                    key, value = line.split('=', 1)
-                    credentials[key.strip()] = value.strip()
+        with open(self.credentials_file, 'r', encoding='utf-8') as f:
+            text = f.read()
+        
+        for line in text.splitlines():
+            line = line.strip()
+            if not line or line[0] == '#':
+                continue
+            key, sep, value = line.partition('=')
+            if sep:
+                credentials[key.strip()] = value.strip()
         return credentials
     
+    def _set_credential(self, key: str, value: str):
+        """Update a credential, marking it for the next save only if the value changed."""
+        if self.credentials.get(key) != value:
+            self.credentials[key] = value
+            self._dirty_keys.add(key)
+    
     def _save_credentials(self):
-        """Save updated credentials back to config file."""
-        with open(self.credentials_file, 'w') as f:
+        """Save updated credentials back to config file (atomically, and only if something changed)."""
+        if not self._dirty_keys:
+            return
+        
+        # Per-process temp file so overlapping runs never write into each other's partial file
+        tmp_file = f"{self.credentials_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
             for key, value in self.credentials.items():
                 f.write(f"{key}={value}\n")
+        
+        # Keep the original file's permissions (credentials are often chmod 600)
+        if os.path.exists(self.credentials_file):
+            os.chmod(tmp_file, stat.S_IMODE(os.stat(self.credentials_file).st_mode))
+        os.replace(tmp_file, self.credentials_file)
+        self._dirty_keys.clear()
     
-    def _is_token_expired(self) -> bool:
-        """Check if access token is likely expired (QuickBooks tokens expire in 1 hour)."""
+    def _parse_token_expiry(self) -> Optional[float]:
+        """Convert TOKEN_TIMESTAMP into the time.monotonic() value at which the access token expires."""
         token_timestamp = self.credentials.get('TOKEN_TIMESTAMP')
         if not token_timestamp:
-            return True
+            return None
             
         try:
-            token_time = datetime.fromisoformat(token_timestamp)
-            # Consider token expired if it's more than 55 minutes old (5-minute buffer)
-            return datetime.now() - token_time > timedelta(minutes=55)
+            issued_at = datetime.fromisoformat(token_timestamp)
         except (ValueError, TypeError):
-            return True
+            return None
+        # Timestamps with an offset or 'Z' parse as aware; compare everything in naive local time
+        if issued_at.tzinfo is not None:
+            issued_at = issued_at.astimezone().replace(tzinfo=None)
+        return time.monotonic() + (issued_at + TOKEN_LIFETIME - datetime.now()).total_seconds()
+    
+    def _is_token_expired(self) -> bool:
+        """Check if access token is likely expired (QuickBooks tokens expire in 1 hour)."""
+        return self._expiry_monotonic is None or time.monotonic() >= self._expiry_monotonic
     
     def refresh_access_token(self) -> bool:
         """
@@ -88,31 +243,24 @@ class QuickBooksAuthManager:
             bool: True if refresh was successful, False otherwise
         """
         refresh_token = self.credentials.get('INTUIT_REFRESH_TOKEN')
-        client_id = self.credentials.get('INTUIT_CLIENT_ID')
-        client_secret = self.credentials.get('INTUIT_CLIENT_SECRET')
         
-        if not all([refresh_token, client_id, client_secret]):
-            print("❌ Missing required credentials for token refresh")
+        if not refresh_token or not self._basic_auth_header:
+            logger.error("❌ Missing required credentials for token refresh")
             return False
         
-        headers = {
-            'Accept': 'application/json',
-            'Authorization': f'Basic {self._get_basic_auth(client_id, client_secret)}',
-            'Content-Type': 'application/x-www-form-urlencoded'
-        }
-        
         data = {
             'grant_type': 'refresh_token',
             'refresh_token': refresh_token
         }
         
         try:
-            print("🔄 Refreshing QuickBooks access token...")
+            logger.info("🔄 Refreshing QuickBooks access token...")
             
             # Log the request
-            self.error_handler.log_api_request('POST', self.token_endpoint, headers, data)
+            self.error_handler.log_api_request('POST', self.token_endpoint, self._refresh_headers, data)
             
-            response = requests.post(self.token_endpoint, headers=headers, data=data)
+            response = self._session.post(self.token_endpoint, headers=self._refresh_headers, data=data,
+                                          timeout=TOKEN_REQUEST_TIMEOUT)
             
             # Log the response
             response_data = self.error_handler.log_api_response(response)
@@ -121,60 +269,62 @@ class QuickBooksAuthManager:
                 token_data = response.json()
                 
                 # Update credentials with new tokens
-                self.credentials['INTUIT_ACCESS_TOKEN'] = token_data['access_token']
-                self.credentials['INTUIT_REFRESH_TOKEN'] = token_data['refresh_token']
-                self.credentials['TOKEN_TIMESTAMP'] = datetime.now().isoformat()
+                self._set_credential('INTUIT_ACCESS_TOKEN', token_data['access_token'])
+                self._set_credential('INTUIT_REFRESH_TOKEN', token_data['refresh_token'])
+                self._set_credential('TOKEN_TIMESTAMP', datetime.now().isoformat())
+                # Publish the new headers before the new expiry, so a thread that sees a fresh
+                # expiry can never pick up the old Authorization header
+                self._cached_headers = self._build_auth_headers()
+                self._expiry_monotonic = time.monotonic() + TOKEN_LIFETIME.total_seconds()
                 
                 # Save to file
                 self._save_credentials()
                 
-                print("✅ Token refreshed successfully")
+                logger.info("✅ Token refreshed successfully")
                 return True
             else:
                 # Handle errors using the error handler
-                error_info = self.error_handler.handle_api_error(response)
+                error_info = self.error_handler.handle_api_error(response, response_data['timestamp'])
                 
                 error_type = error_info.get('error_type', 'unknown_error')
                 error_message = error_info.get('error_message', response.text)
                 
                 # Handle specific error types
                 if 'invalid_grant' in error_type or 'authentication_error' in error_type:
-                    print(f"❌ {error_message}")
-                    print("   → Manual re-authorization required through QuickBooks OAuth flow")
+                    logger.error("❌ %s", error_message)
+                    logger.error("   → Manual re-authorization required through QuickBooks OAuth flow")
                     if error_info.get('intuit_tid'):
-                        print(f"   → Reference ID for support: {error_info['intuit_tid']}")
+                        logger.error("   → Reference ID for support: %s", error_info['intuit_tid'])
                     # Clear invalid tokens to prevent retry loops
-                    self.credentials['INTUIT_REFRESH_TOKEN'] = 'EXPIRED'
+                    self._set_credential('INTUIT_REFRESH_TOKEN', 'EXPIRED')
                     self._save_credentials()
                     return False
                 else:
-                    print(f"❌ {error_message}")
+                    logger.error("❌ %s", error_message)
                     if error_info.get('troubleshooting_steps'):
-                        print("   Troubleshooting steps:")
+                        logger.error("   Troubleshooting steps:")
                         for step in error_info['troubleshooting_steps'][:3]:  # Show first 3 steps
-                            print(f"     • {step}")
+                            logger.error("     • %s", step)
                     if error_info.get('intuit_tid'):
-                        print(f"   → Reference ID for support: {error_info['intuit_tid']}")
+                        logger.error("   → Reference ID for support: %s", error_info['intuit_tid'])
                     return False
                 
-        except requests.exceptions.Timeout:
-            print("❌ TIMEOUT ERROR: Request to QuickBooks took too long")
-            print("   → Network issue, retry may succeed")
+        except requests.exceptions.ConnectTimeout:
+            logger.error("❌ TIMEOUT ERROR: Could not connect to the QuickBooks token endpoint in time")
+            logger.error("   → Network issue, retry may succeed")
+            return False
+        except requests.exceptions.ReadTimeout:
+            logger.error("❌ TIMEOUT ERROR: QuickBooks token endpoint accepted the connection but did not respond")
+            logger.error("   → Intuit service may be slow, retry may succeed")
             return False
         except requests.exceptions.ConnectionError:
-            print("❌ CONNECTION ERROR: Unable to connect to QuickBooks")
-            print("   → Check internet connection")
+            logger.error("❌ CONNECTION ERROR: Unable to connect to QuickBooks")
+            logger.error("   → Check internet connection")
             return False
         except Exception as e:
-            print(f"❌ UNEXPECTED ERROR during token refresh: {e}")
+            logger.error("❌ UNEXPECTED ERROR during token refresh: %s", e)
             return False
     
-    def _get_basic_auth(self, client_id: str, client_secret: str) -> str:
-        """Generate base64 encoded basic auth string."""
-        import base64
-        auth_string = f"{client_id}:{client_secret}"
-        return base64.b64encode(auth_string.encode()).decode()
-    
     def get_valid_headers(self) -> Optional[Dict[str, str]]:
         """
         Get valid authorization headers, refreshing token if necessary.
@@ -182,17 +332,30 @@ class QuickBooksAuthManager:
         Returns:
             Dict with valid headers, or None if unable to get valid token
         """
-        # Check if token needs refresh
+        # Check if token needs refresh (re-checked under the lock so only one thread refreshes)
         if self._is_token_expired():
-            if not self.refresh_access_token():
-                print("❌ Unable to refresh expired token")
-                return None
-        
+            with self._refresh_lock:
+                if self._is_token_expired() and not self.refresh_access_token():
+                    logger.error("❌ Unable to refresh expired token")
+                    return None
+        
+        # Headers are only ever replaced under the lock, so a stale build cannot overwrite a refresh
+        headers = self._cached_headers
+        if headers is None:
+            with self._refresh_lock:
+                if self._cached_headers is None:
+                    self._cached_headers = self._build_auth_headers()
+                headers = self._cached_headers
+            if headers is None:
+                logger.error("❌ No access token available")
+        
+        return headers
+    
+    def _build_auth_headers(self) -> Optional[Dict[str, str]]:
+        """Build auth headers from the current access token (None if there is none)."""
         access_token = self.credentials.get('INTUIT_ACCESS_TOKEN')
         if not access_token:
-            print("❌ No access token available")
             return None
-        
         return {
             'Authorization': f'Bearer {access_token}',
             'Accept': 'application/json',
@@ -212,21 +375,26 @@ class QuickBooksAuthManager:
         Returns:
             Response object or None if all retries failed
         """
-        max_retries = 2
+        max_retries = self._max_retries
+        
+        # Caller headers are merged over fresh auth headers on every attempt, so a retry
+        # after a token refresh never reuses the stale Authorization header
+        extra_headers = kwargs.pop('headers', None) or {}
         
         for attempt in range(max_retries + 1):
-            headers = self.get_valid_headers()
-            if not headers:
-                print(f"❌ Unable to get valid headers (attempt {attempt + 1})")
+            auth_headers = self.get_valid_headers()
+            if not auth_headers:
+                logger.warning("❌ Unable to get valid headers (attempt %s)", attempt + 1)
                 if attempt < max_retries:
                     continue
                 return None
             
-            # Merge with any existing headers
-            if 'headers' in kwargs:
-                headers.update(kwargs['headers'])
+            # Merge with any caller-supplied headers (without mutating the cached auth headers)
+            headers = {**auth_headers, **extra_headers}
             kwargs['headers'] = headers
             
+            self._bucket.acquire()
+            
             try:
                 # Set timeout to handle hanging requests
                 if 'timeout' not in kwargs:
@@ -235,74 +403,94 @@ class QuickBooksAuthManager:
                 # Log the request
                 self.error_handler.log_api_request(method, url, headers, kwargs.get('json'), kwargs.get('params'))
                 
-                response = requests.request(method, url, **kwargs)
+                response = self._session.request(method, url, **kwargs)
                 
                 # Log the response
                 response_data = self.error_handler.log_api_response(response)
                 
                 # Handle errors using comprehensive error handler
                 if response.status_code >= 400:
-                    error_info = self.error_handler.handle_api_error(response)
+                    error_info = self.error_handler.handle_api_error(response, response_data['timestamp'])
                     
                     if response.status_code == 401 and attempt < max_retries:
-                        print(f"🔄 EXPIRED ACCESS TOKEN: Attempting refresh (attempt {attempt + 1})")
-                        # Force refresh by clearing timestamp
-                        self.credentials['TOKEN_TIMESTAMP'] = '2020-01-01T00:00:00'
+                        logger.warning("🔄 EXPIRED ACCESS TOKEN: Attempting refresh (attempt %s)", attempt + 1)
+                        # Force a refresh by clearing the cached expiry, unless another thread has
+                        # already refreshed since this request was sent (that would rotate the tokens twice)
+                        with self._refresh_lock:
+                            if self._cached_headers is auth_headers:
+                                self._expiry_monotonic = None
                         continue
                     elif response.status_code == 403:
-                        print(f"❌ {error_info['error_message']}")
+                        logger.error("❌ %s", error_info['error_message'])
                         if error_info.get('intuit_tid'):
-                            print(f"   → Reference ID: {error_info['intuit_tid']}")
+                            logger.error("   → Reference ID: %s", error_info['intuit_tid'])
                         return response  # Don't retry CSRF errors
                     elif response.status_code >= 500 and attempt < max_retries:
-                        print(f"🔄 SERVER ERROR: Retrying... (attempt {attempt + 1})")
-                        time.sleep(2 ** attempt)  # Exponential backoff
+                        # A 503 may say when to come back; otherwise back off exponentially
+                        delay = _retry_after_seconds(response) if response.status_code == 503 else None
+                        if delay is None:
+                            delay = _backoff_delay(attempt)
+                        logger.warning("🔄 SERVER ERROR: Retrying in %.1fs... (attempt %s)", delay, attempt + 1)
+                        time.sleep(delay)
                         continue
                     elif response.status_code == 429 and attempt < max_retries:
-                        retry_after = error_info.get('retry_after_seconds', 60)
-                        print(f"🔄 RATE LIMITED: Waiting {retry_after}s before retry (attempt {attempt + 1})")
+                        retry_after = _retry_after_seconds(response)
+                        if retry_after is None:
+                            retry_after = error_info.get('retry_after_seconds', 60)
+                        logger.warning("🔄 RATE LIMITED: Waiting %.0fs before retry (attempt %s)",
+                                       retry_after, attempt + 1)
                         time.sleep(retry_after)
                         continue
                     else:
-                        print(f"❌ {error_info['error_message']}")
+                        logger.error("❌ %s", error_info['error_message'])
                         if error_info.get('intuit_tid'):
-                            print(f"   → Reference ID for support: {error_info['intuit_tid']}")
+                            logger.error("   → Reference ID for support: %s", error_info['intuit_tid'])
                         if not error_info.get('retry_recommended') and response.status_code != 401:
                             return response  # Don't retry non-retryable errors
                 
+                if response.status_code < 300:
+                    self._last_success_monotonic = time.monotonic()
                 return response
                 
             except requests.exceptions.Timeout:
-                print(f"❌ TIMEOUT ERROR: Request took too long (attempt {attempt + 1})")
+                logger.warning("❌ TIMEOUT ERROR: Request took too long (attempt %s)", attempt + 1)
                 if attempt < max_retries:
-                    time.sleep(1)
+                    time.sleep(_backoff_delay(attempt))
                     continue
                     
             except requests.exceptions.ConnectionError:
-                print(f"❌ CONNECTION ERROR: Unable to connect to QuickBooks (attempt {attempt + 1})")
+                logger.warning("❌ CONNECTION ERROR: Unable to connect to QuickBooks (attempt %s)", attempt + 1)
                 if attempt < max_retries:
-                    time.sleep(2)
+                    time.sleep(_backoff_delay(attempt + 1))
                     continue
                     
             except Exception as e:
-                print(f"❌ REQUEST EXCEPTION (attempt {attempt + 1}): {e}")
+                logger.warning("❌ REQUEST EXCEPTION (attempt %s): %s", attempt + 1, e)
                 if attempt < max_retries:
-                    time.sleep(1)
+                    time.sleep(_backoff_delay(attempt))
                     continue
         
-        print("❌ All request attempts failed")
+        logger.error("❌ All request attempts failed")
         return None
     
-    def validate_connection(self) -> bool:
+    def validate_connection(self, force: bool = False) -> bool:
         """
         Test the QuickBooks connection with current credentials.
+        Skipped when a request succeeded in the last few minutes with a still-valid token.
+        
+        Args:
+            force: Always make the companyinfo request
         
         Returns:
             bool: True if connection is valid, False otherwise
         """
+        if (not force and self._last_success_monotonic is not None and not self._is_token_expired()
+                and time.monotonic() - self._last_success_monotonic < VALIDATION_FRESH_SECONDS):
+            return True
+        
         realm_id = self.credentials.get('INTUIT_REALM_ID')
         if not realm_id:
-            print("❌ Missing INTUIT_REALM_ID")
+            logger.error("❌ Missing INTUIT_REALM_ID")
             return False
         
         # Test with a simple company info query
@@ -311,46 +499,58 @@ class QuickBooksAuthManager:
         response = self.make_authenticated_request('GET', test_url)
         
         if response and response.status_code == 200:
-            print("✅ QuickBooks connection validated")
+            logger.info("✅ QuickBooks connection validated")
             return True
         else:
             status = response.status_code if response else "No response"
-            print(f"❌ QuickBooks connection failed: {status}")
+            logger.error("❌ QuickBooks connection failed: %s", status)
             return False
     
     def set_production_mode(self, production: bool = True):
         """Switch between sandbox and production environments (deprecated - use constructor)."""
-        print("⚠️  WARNING: set_production_mode() is deprecated. Use environment parameter in constructor.")
+        logger.warning("⚠️  WARNING: set_production_mode() is deprecated. Use environment parameter in constructor.")
         if production:
             self.base_url = "https://quickbooks.api.intuit.com"
             self.environment = "production"
-            print("🚀 Switched to production environment")
+            self._bucket = _create_rate_limiter(self.environment)
+            logger.info("🚀 Switched to production environment")
         else:
             self.base_url = "https://sandbox-quickbooks.api.intuit.com" 
             self.environment = "sandbox"
-            print("🧪 Switched to sandbox environment")
+            self._bucket = _create_rate_limiter(self.environment)
+            logger.info("🧪 Switched to sandbox environment")
     
     def requires_manual_reauth(self) -> bool:
         """
         Check if manual re-authorization is required.
-        This happens when refresh tokens are expired or invalid.
+        This happens when refresh tokens are missing or were rejected by a previous refresh.
+        Only local state is inspected; an expired access token is refreshed by the next
+        request anyway (use probe_refresh_token for an explicit preflight check).
         
         Returns:
             bool: True if OAuth playground re-authorization is needed
         """
         refresh_token = self.credentials.get('INTUIT_REFRESH_TOKEN', '')
+        return not refresh_token or refresh_token == 'EXPIRED'
+    
+    def probe_refresh_token(self) -> bool:
+        """
+        Preflight check that the refresh token still works, refreshing now if the access token
+        has expired. Costs a token endpoint round-trip, so only call it when that is wanted.
         
-        # Check for obvious invalid states
-        if not refresh_token or refresh_token == 'EXPIRED':
-            return True
+        Returns:
+            bool: True if the tokens are usable, False if manual re-authorization is needed
+        """
+        if self.requires_manual_reauth():
+            return False
         
-        # Try a test refresh to see if token is valid
         if self._is_token_expired():
-            print("🔍 Testing refresh token validity...")
-            if not self.refresh_access_token():
-                return True
+            logger.info("🔍 Testing refresh token validity...")
+            with self._refresh_lock:
+                if self._is_token_expired() and not self.refresh_access_token():
+                    return False
         
-        return False
+        return True
     
     def get_reauth_instructions(self) -> str:
         """
@@ -386,6 +586,11 @@ Your QuickBooks tokens have expired and need to be refreshed manually.
         
         return instructions
     
+    def close(self):
+        """Close pooled connections held by the session and flush the API log."""
+        self._session.close()
+        QuickBooksErrorHandler.close_logging()
+    
     def get_support_info(self) -> str:
         """Get support contact information and error details."""
         return self.error_handler.get_support_info()
@@ -404,6 +609,11 @@ def example_usage():
         print(f"🔧 Testing {auth.environment} environment")
         print(f"📁 Using credentials: {auth.credentials_file}")
         
+        # Cheap local check first; the connection test below refreshes the token if needed
+        if auth.requires_manual_reauth():
+            print(auth.get_reauth_instructions())
+            return
+        
         # Test connection
         if not auth.validate_connection():
             print("Connection failed - check credentials")
@@ -4,21 +4,96 @@ QuickBooks API Error Handler and Logger
 Handles API errors, validation errors, response headers, and logging for QuickBooks certification
 """
 
-import json
+import atexit
 import logging
+import logging.handlers
 import os
+import queue
+from collections import Counter, deque
+import orjson
 from datetime import datetime
 from typing import Dict, Any, Optional, List
 import requests
 
 
+# Most recent errors (and QuickBooks reference IDs) kept in memory for the session summary
+ERROR_LOG_LIMIT = 1000
+
+# Static tail of get_support_info
+_SUPPORT_GUIDANCE = """
+📋 WHEN CONTACTING SUPPORT:
+1. Describe what you were trying to do
+2. Include the timestamp when the error occurred
+3. Provide any QuickBooks reference IDs listed above
+4. Attach the log file if requested
+5. Include your company/realm ID (if safe to share)
+
+⚡ SELF-SERVICE TROUBLESHOOTING:
+1. Check logs/qb_api.log for detailed error information
+2. Verify your internet connection
+3. Try the operation again (some errors are temporary)
+4. For authentication errors, the system will guide you through re-authorization
+        """
+
+
+def _pretty_json(data: Any) -> str:
+    """Indented JSON for the API log (orjson is several times faster than json.dumps)."""
+    return orjson.dumps(data, option=orjson.OPT_INDENT_2).decode()
+
+
+class LazyJsonFormatter(logging.Formatter):
+    """Formatter that pretty-prints dict/list log arguments only when a record is emitted."""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        args = record.args
+        # LogRecord unwraps a lone dict argument; this logger never uses %(name)s-style messages
+        if isinstance(args, dict):
+            args = (args,)
+        if isinstance(args, tuple) and any(isinstance(arg, (dict, list)) for arg in args):
+            record.args = tuple(_pretty_json(arg) if isinstance(arg, (dict, list)) else arg for arg in args)
+        return super().format(record)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that enqueues records unformatted, leaving all formatting to the listener thread."""
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def _first_fault_error(error_data: Any) -> Dict[str, Any]:
+    """Pull Fault.Error[0] out of a parsed QuickBooks error body, or {} if there is none."""
+    fault = error_data.get('Fault') if isinstance(error_data, dict) else None
+    errors = fault.get('Error') if isinstance(fault, dict) else None
+    return errors[0] if errors else {}
+
+
 class QuickBooksErrorHandler:
     """Handles QuickBooks API errors, logging, and response tracking for certification compliance."""
     
+    # Background listener shared by the 'QuickBooksAPI' logger; replaced when a new handler is set up
+    _listener: Optional[logging.handlers.QueueListener] = None
+    
+    # Status code -> handler method; other 5xx statuses fall back to _handle_500_errors
+    _HANDLERS = {
+        400: '_handle_400_errors',
+        401: '_handle_401_errors',
+        403: '_handle_403_errors',
+        404: '_handle_404_errors',
+        429: '_handle_429_errors',
+        500: '_handle_500_errors'
+    }
+    
     def __init__(self, log_file: str = "qb_api.log"):
         self.log_file = log_file
         self.setup_logging()
-        self.error_log = []
+        self.error_log = deque(maxlen=ERROR_LOG_LIMIT)
+        # Running summary totals, so get_error_summary never rescans the log
+        self._error_count = 0
+        self._first_error = None
+        self._category_counts = Counter()
+        self._intuit_tids = deque(maxlen=ERROR_LOG_LIMIT)
+        self._handlers = {status: getattr(self, name) for status, name in self._HANDLERS.items()}
         
     def setup_logging(self):
         """Set up comprehensive logging for API interactions."""
@@ -26,39 +101,60 @@ class QuickBooksErrorHandler:
         os.makedirs("logs", exist_ok=True)
         log_path = f"logs/{self.log_file}"
         
-        # Configure logging with detailed format
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(log_path, mode='a', encoding='utf-8'),
-                logging.StreamHandler()  # Also log to console
-            ]
-        )
+        # Configure logging with detailed format; JSON arguments are serialized only when emitted
+        formatter = LazyJsonFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        file_handler = logging.FileHandler(log_path, mode='a', encoding='utf-8')
+        stream_handler = logging.StreamHandler()  # Also log to console
+        for handler in (file_handler, stream_handler):
+            handler.setFormatter(formatter)
+        
+        # API calls only enqueue records; a background thread does the formatting (timestamps,
+        # JSON bodies) and disk writes
+        QuickBooksErrorHandler.close_logging()
+        log_queue = queue.Queue(-1)
+        QuickBooksErrorHandler._listener = logging.handlers.QueueListener(
+            log_queue, file_handler, stream_handler, respect_handler_level=True)
+        QuickBooksErrorHandler._listener.start()
         
         self.logger = logging.getLogger('QuickBooksAPI')
+        self.logger.handlers.clear()
+        self.logger.addHandler(_DeferredQueueHandler(log_queue))
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        
         self.logger.info("="*80)
         self.logger.info("QuickBooks API session started")
         self.logger.info("="*80)
     
+    @staticmethod
+    def close_logging():
+        """Flush queued log records and stop the background listener (safe to call repeatedly)."""
+        listener = QuickBooksErrorHandler._listener
+        if listener is not None:
+            QuickBooksErrorHandler._listener = None
+            listener.stop()
+            for handler in listener.handlers:
+                handler.close()
+    
     def log_api_request(self, method: str, url: str, headers: Dict[str, str], 
                        data: Any = None, params: Dict[str, str] = None):
         """Log API request details for troubleshooting."""
-        self.logger.info(f"API REQUEST: {method} {url}")
+        # Nothing below is worth serializing if INFO records would be dropped
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
         
-        # Log sanitized headers (remove authorization)
-        safe_headers = {k: v for k, v in headers.items() if k.lower() != 'authorization'}
-        safe_headers['Authorization'] = '[REDACTED]' if 'authorization' in [h.lower() for h in headers.keys()] else None
-        self.logger.info(f"Request headers: {json.dumps(safe_headers, indent=2)}")
+        self.logger.info("API REQUEST: %s %s", method, url)
+        
+        # Log sanitized headers (redact authorization in the same pass)
+        safe_headers = {k: ('[REDACTED]' if k.lower() == 'authorization' else v) for k, v in headers.items()}
+        self.logger.info("Request headers: %s", safe_headers)
         
         if params:
-            self.logger.info(f"Request params: {json.dumps(params, indent=2)}")
+            self.logger.info("Request params: %s", params)
             
         if data:
-            if isinstance(data, (dict, list)):
-                self.logger.info(f"Request body: {json.dumps(data, indent=2)}")
-            else:
-                self.logger.info(f"Request body: {data}")
+            # dict/list bodies are serialized by LazyJsonFormatter when the record is emitted
+            self.logger.info("Request body: %s", data)
     
     def log_api_response(self, response: requests.Response) -> Dict[str, Any]:
         """
@@ -75,36 +171,44 @@ class QuickBooksErrorHandler:
             'response_time_ms': getattr(response, 'elapsed', None)
         }
         
-        self.logger.info(f"API RESPONSE: {response.status_code} from {response.url}")
-        self.logger.info(f"Response headers: {json.dumps(dict(response.headers), indent=2)}")
+        # Pretty-printed headers and bodies are only built when INFO records will be emitted
+        log_details = self.logger.isEnabledFor(logging.INFO)
         
-        # Log intuit_tid for QuickBooks support troubleshooting
-        if response_data['intuit_tid']:
-            self.logger.info(f"INTUIT_TID (for QB support): {response_data['intuit_tid']}")
+        if log_details:
+            self.logger.info("API RESPONSE: %s from %s", response.status_code, response.url)
+            self.logger.info("Response headers: %s", response_data['headers'])
+            
+            # Log intuit_tid for QuickBooks support troubleshooting
+            if response_data['intuit_tid']:
+                self.logger.info("INTUIT_TID (for QB support): %s", response_data['intuit_tid'])
         
         # Log response body (safely)
         try:
-            if response.text:
-                response_json = response.json()
-                self.logger.info(f"Response body: {json.dumps(response_json, indent=2)}")
+            if response.content:
+                response_json = orjson.loads(response.content)
+                if log_details:
+                    self.logger.info("Response body: %s", response_json)
                 response_data['body'] = response_json
-        except json.JSONDecodeError:
-            # Log non-JSON responses safely
-            body_preview = response.text[:500] + "..." if len(response.text) > 500 else response.text
-            self.logger.info(f"Response body (non-JSON): {body_preview}")
-            response_data['body'] = response.text
+        except orjson.JSONDecodeError:
+            # Log non-JSON responses safely, decoding the body bytes only once
+            body_text = response.content.decode('utf-8', errors='replace')
+            if log_details:
+                body_preview = body_text[:500] + "..." if len(body_text) > 500 else body_text
+                self.logger.info("Response body (non-JSON): %s", body_preview)
+            response_data['body'] = body_text
         except Exception as e:
-            self.logger.warning(f"Could not log response body: {e}")
+            self.logger.warning("Could not log response body: %s", e)
         
         return response_data
     
-    def handle_api_error(self, response: requests.Response) -> Dict[str, Any]:
+    def handle_api_error(self, response: requests.Response, timestamp: Optional[str] = None) -> Dict[str, Any]:
         """
         Handle and categorize QuickBooks API errors for certification compliance.
         Includes syntax errors, validation errors, and business logic errors.
+        Pass the timestamp from log_api_response to reuse it instead of reading the clock again.
         """
         error_info = {
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': timestamp or datetime.now().isoformat(),
             'status_code': response.status_code,
             'url': response.url,
             'intuit_tid': response.headers.get('intuit_tid'),
@@ -116,43 +220,48 @@ class QuickBooksErrorHandler:
             'retry_recommended': False
         }
         
+        # Parsed once here; _handle_400_errors reads the Fault from raw_error instead of re-parsing
         try:
-            error_data = response.json()
-            error_info['raw_error'] = error_data
-        except:
-            error_info['raw_error'] = response.text
+            error_info['raw_error'] = orjson.loads(response.content)
+        except orjson.JSONDecodeError:
+            error_info['raw_error'] = response.content.decode('utf-8', errors='replace')
             
         # Categorize errors based on status code and content
-        if response.status_code == 400:
-            error_info.update(self._handle_400_errors(response, error_info))
-        elif response.status_code == 401:
-            error_info.update(self._handle_401_errors(response, error_info))
-        elif response.status_code == 403:
-            error_info.update(self._handle_403_errors(response, error_info))
-        elif response.status_code == 404:
-            error_info.update(self._handle_404_errors(response, error_info))
-        elif response.status_code == 429:
-            error_info.update(self._handle_429_errors(response, error_info))
-        elif response.status_code >= 500:
-            error_info.update(self._handle_500_errors(response, error_info))
+        status = response.status_code
+        handler = self._handlers.get(status) or (self._handle_500_errors if status >= 500 else None)
+        if handler:
+            error_info.update(handler(response, error_info))
+        
+        # Only keep the full error body when debugging; the stored error needs just the fault code and detail
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            raw_error = error_info['raw_error']
+            if isinstance(raw_error, str):
+                error_info['raw_error'] = raw_error[:500]
+            else:
+                fault_error = _first_fault_error(raw_error)
+                error_info['raw_error'] = {'code': fault_error.get('code', ''), 'detail': fault_error.get('Detail', '')}
         
         # Log the error comprehensively
-        self.logger.error(f"API ERROR: {error_info['error_type']} - {error_info['error_message']}")
-        self.logger.error(f"Troubleshooting: {'; '.join(error_info['troubleshooting_steps'])}")
+        self.logger.error("API ERROR: %s - %s", error_info['error_type'], error_info['error_message'])
+        self.logger.error("Troubleshooting: %s", '; '.join(error_info['troubleshooting_steps']))
         if error_info['intuit_tid']:
-            self.logger.error(f"Reference ID for QuickBooks support: {error_info['intuit_tid']}")
+            self.logger.error("Reference ID for QuickBooks support: %s", error_info['intuit_tid'])
         
         # Store error for aggregation
         self.error_log.append(error_info)
+        self._error_count += 1
+        self._first_error = self._first_error or error_info['timestamp']
+        self._category_counts[error_info['error_category']] += 1
+        if error_info['intuit_tid']:
+            self._intuit_tids.append(error_info['intuit_tid'])
         
         return error_info
     
     def _handle_400_errors(self, response: requests.Response, error_info: Dict[str, Any]) -> Dict[str, Any]:
         """Handle 400 Bad Request errors - typically syntax and validation errors."""
-        try:
-            error_data = response.json()
-            fault = error_data.get('Fault', {})
-            error = fault.get('Error', [{}])[0] if fault.get('Error') else {}
+        error_data = error_info.get('raw_error')
+        if isinstance(error_data, dict):
+            error = _first_fault_error(error_data)
             
             error_code = error.get('code', '')
             error_detail = error.get('Detail', '')
@@ -186,7 +295,7 @@ class QuickBooksErrorHandler:
                 ]
                 error_info['user_message'] = 'Business rule violation. Please review the data and correct any conflicts.'
                 
-        except:
+        else:
             error_info.update({
                 'error_type': 'syntax_error',
                 'error_category': 'client_error',
@@ -253,7 +362,8 @@ class QuickBooksErrorHandler:
             'error_type': 'rate_limit_exceeded',
             'error_category': 'rate_limit',
             'error_message': f'Rate limit exceeded - retry after {retry_after} seconds',
-            'retry_after_seconds': int(retry_after),
+            # Retry-After may also be an HTTP date; the auth manager parses that form itself
+            'retry_after_seconds': int(retry_after) if retry_after.isdigit() else 60,
             'troubleshooting_steps': [
                 f'Wait {retry_after} seconds before retrying',
                 'Implement exponential backoff',
@@ -282,23 +392,16 @@ class QuickBooksErrorHandler:
     
     def get_error_summary(self) -> Dict[str, Any]:
         """Get summary of all errors encountered in this session."""
-        if not self.error_log:
+        if not self._error_count:
             return {'total_errors': 0, 'error_categories': {}}
         
-        summary = {
-            'total_errors': len(self.error_log),
-            'error_categories': {},
-            'intuit_tids': [err.get('intuit_tid') for err in self.error_log if err.get('intuit_tid')],
-            'first_error': self.error_log[0]['timestamp'],
+        return {
+            'total_errors': self._error_count,
+            'error_categories': dict(self._category_counts),
+            'intuit_tids': list(self._intuit_tids),
+            'first_error': self._first_error,
             'last_error': self.error_log[-1]['timestamp']
         }
-        
-        # Categorize errors
-        for error in self.error_log:
-            category = error['error_category']
-            summary['error_categories'][category] = summary['error_categories'].get(category, 0) + 1
-        
-        return summary
     
     def get_support_info(self) -> str:
         """Get formatted support contact information."""
@@ -317,30 +420,20 @@ class QuickBooksErrorHandler:
 """
         
         if intuit_tids:
-            support_info += f"""
-🎫 QUICKBOOKS REFERENCE IDs (provide to QuickBooks support):
-{chr(10).join(f'   • {tid}' for tid in intuit_tids[:5])}
-{"   • ... and more (see log file)" if len(intuit_tids) > 5 else ""}
-"""
+            tid_lines = ["", "🎫 QUICKBOOKS REFERENCE IDs (provide to QuickBooks support):"]
+            tid_lines += [f"   • {tid}" for tid in intuit_tids[:5]]
+            tid_lines.append("   • ... and more (see log file)" if len(intuit_tids) > 5 else "")
+            support_info += "\n".join(tid_lines) + "\n"
         
-        support_info += """
-📋 WHEN CONTACTING SUPPORT:
-1. Describe what you were trying to do
-2. Include the timestamp when the error occurred
-3. Provide any QuickBooks reference IDs listed above
-4. Attach the log file if requested
-5. Include your company/realm ID (if safe to share)
-
-⚡ SELF-SERVICE TROUBLESHOOTING:
-1. Check logs/qb_api.log for detailed error information
-2. Verify your internet connection
-3. Try the operation again (some errors are temporary)
-4. For authentication errors, the system will guide you through re-authorization
-        """
+        support_info += _SUPPORT_GUIDANCE
         
         return support_info
 
 
+# Queued records are written out before the interpreter exits
+atexit.register(QuickBooksErrorHandler.close_logging)
+
+
 def create_error_handler() -> QuickBooksErrorHandler:
     """Factory function to create a standardized error handler."""
     return QuickBooksErrorHandler()
@@ -5,11 +5,33 @@ Fetches customer IDs and service/item IDs from QuickBooks API for invoice automa
 """
 
 import json
+import orjson
 import requests
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 import os
+import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from qb_http import QUERY_PAGE_SIZE, create_session, fetch_query_pages, paged_query, run_batch
+
+
+# (connect, read) timeouts for QuickBooks API calls
+REQUEST_TIMEOUT = (3.05, 30)
+
+# (entity, where clause) for each query; both are paged past QuickBooks' per-query row limit
+CUSTOMER_QUERY = ("Customer", "")
+ITEM_QUERY = ("Item", "WHERE Active = true")
+
+# Known Notion clients from validation, compiled into one case-insensitive scan
+NOTION_CLIENTS = ["ABA", "HumanGood", "Humangood"]
+NOTION_CLIENT_NEEDLES = {name.lower() for name in NOTION_CLIENTS}
+NOTION_CLIENT_RE = re.compile("|".join(re.escape(name) for name in sorted(NOTION_CLIENT_NEEDLES)), re.IGNORECASE)
+
+
+def _query_text(select: str, entity: str, where: str = "") -> str:
+    """Build a query such as "SELECT * FROM Item WHERE Active = true"."""
+    return f"SELECT {select} FROM {entity} {where}".rstrip()
 
 
 class QuickBooksClient:
@@ -26,6 +48,20 @@ class QuickBooksClient:
             'Accept': 'application/json',
             'Content-Type': 'application/json'
         }
+        
+        # Pooled keep-alive session (shared retry policy), so every query reuses one TLS connection
+        self.session = create_session(pool_connections=1, pool_maxsize=10)
+        self.session.headers.update(self.headers)
+    
+    def close(self):
+        """Close pooled connections held by the session."""
+        self.session.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
     
     def _load_config(self, config_path: str) -> Dict:
         """Load configuration from JSON file."""
@@ -46,23 +82,47 @@ class QuickBooksClient:
         url = f"{self.base_url}/v3/company/{self.realm_id}/{endpoint}"
         
         try:
-            response = requests.get(url, headers=self.headers)
+            response = self.session.get(url, timeout=REQUEST_TIMEOUT)
             response.raise_for_status()
-            return response.json()
+            return orjson.loads(response.content)
         except requests.exceptions.RequestException as e:
             print(f"❌ API request failed: {e}")
             if hasattr(e.response, 'text'):
                 print(f"Response: {e.response.text}")
             return {}
+        except orjson.JSONDecodeError as e:
+            print(f"❌ Invalid JSON from QuickBooks: {e}")
+            return {}
+    
+    def _paginated_query(self, entity: str, where: str = "") -> List[Dict]:
+        """
+        Fetch every matching row: read the COUNT(*) first, then request all
+        STARTPOSITION/MAXRESULTS pages concurrently over the pooled session.
+        
+        Args:
+            entity: QuickBooks entity name (e.g. 'Customer')
+            where: Optional WHERE clause
+            
+        Returns:
+            All matching records, in query order
+        """
+        response = self._make_request(f"query?query={_query_text('COUNT(*)', entity, where)}")
+        total_count = response.get('QueryResponse', {}).get('totalCount', 0)
+        
+        try:
+            return fetch_query_pages(self.base_url, self.realm_id, _query_text('*', entity, where),
+                                     entity, total_count, session=self.session)
+        except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
+            print(f"❌ API request failed: {e}")
+            return []
     
     def get_customers(self) -> List[Dict]:
         """Fetch all customers from QuickBooks."""
         print("📋 Fetching customers...")
         
-        response = self._make_request("query?query=SELECT * FROM Customer")
+        customers = self._paginated_query(*CUSTOMER_QUERY)
         
-        if 'QueryResponse' in response and 'Customer' in response['QueryResponse']:
-            customers = response['QueryResponse']['Customer']
+        if customers:
             print(f"✅ Found {len(customers)} customers")
             return customers
         else:
@@ -73,48 +133,87 @@ class QuickBooksClient:
         """Fetch all items/services from QuickBooks."""
         print("🛍️ Fetching items/services...")
         
-        response = self._make_request("query?query=SELECT * FROM Item WHERE Active = true")
+        items = self._paginated_query(*ITEM_QUERY)
         
-        if 'QueryResponse' in response and 'Item' in response['QueryResponse']:
-            items = response['QueryResponse']['Item']
+        if items:
             print(f"✅ Found {len(items)} active items/services")
             return items
         else:
             print("⚠️ No items found")
             return []
     
+    def get_customers_and_items(self) -> Optional[Tuple[List[Dict], List[Dict]]]:
+        """
+        Fetch customers and active items with one batch request instead of two queries.
+        The batch carries each entity's COUNT(*) and first page; any further pages are
+        then fetched concurrently.
+        
+        Returns:
+            Tuple of (customers, items), or None if the batch request failed
+        """
+        print("📋 Fetching customers and items/services in one batch request...")
+        
+        try:
+            responses = run_batch(self.base_url, self.realm_id, [
+                op
+                for b_id, (entity, where) in (('customers', CUSTOMER_QUERY), ('items', ITEM_QUERY))
+                for op in ({'bId': f"{b_id}_count", 'Query': _query_text('COUNT(*)', entity, where)},
+                           {'bId': b_id, 'Query': paged_query(_query_text('*', entity, where))})
+            ], session=self.session, timeout=REQUEST_TIMEOUT)
+        except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
+            print(f"⚠️ Batch request failed ({e}) - querying separately")
+            return None
+        
+        results = []
+        for b_id, (entity, where), label in (('customers', CUSTOMER_QUERY, 'customers'),
+                                             ('items', ITEM_QUERY, 'active items/services')):
+            item = responses.get(b_id, {})
+            if 'Fault' in item:
+                print(f"❌ {entity} query failed: {item['Fault']}")
+            records = item.get('QueryResponse', {}).get(entity, [])
+            
+            total_count = responses.get(f"{b_id}_count", {}).get('QueryResponse', {}).get('totalCount', 0)
+            if total_count > QUERY_PAGE_SIZE:
+                try:
+                    records += fetch_query_pages(self.base_url, self.realm_id, _query_text('*', entity, where),
+                                                 entity, total_count, first_page=1, session=self.session)
+                except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
+                    print(f"❌ Fetching remaining {entity} pages failed: {e}")
+            print(f"✅ Found {len(records)} {label}" if records else f"⚠️ No {label} found")
+            results.append(records)
+        
+        customers, items = results
+        return customers, items
+    
     def format_customers(self, customers: List[Dict]) -> None:
-        """Print formatted customer information."""
-        print("\n" + "="*60)
-        print("💼 CUSTOMERS")
-        print("="*60)
+        """Print formatted customer information (buffered into a single write)."""
+        lines = ["", "="*60, "💼 CUSTOMERS", "="*60]
         
         for customer in customers:
-            print(f"Name: {customer.get('Name', 'N/A')}")
-            print(f"ID: {customer.get('Id', 'N/A')}")
+            lines.append(f"Name: {customer.get('Name', 'N/A')}")
+            lines.append(f"ID: {customer.get('Id', 'N/A')}")
             if 'CompanyName' in customer:
-                print(f"Company: {customer['CompanyName']}")
-            if customer.get('Active', True):
-                print("Status: Active")
-            else:
-                print("Status: Inactive")
-            print("-" * 30)
+                lines.append(f"Company: {customer['CompanyName']}")
+            lines.append(f"Status: {'Active' if customer.get('Active', True) else 'Inactive'}")
+            lines.append("-" * 30)
+        
+        sys.stdout.write("\n".join(lines) + "\n")
     
     def format_items(self, items: List[Dict]) -> None:
-        """Print formatted item information."""
-        print("\n" + "="*60)
-        print("🛍️ ITEMS/SERVICES")
-        print("="*60)
+        """Print formatted item information (buffered into a single write)."""
+        lines = ["", "="*60, "🛍️ ITEMS/SERVICES", "="*60]
         
         for item in items:
-            print(f"Name: {item.get('Name', 'N/A')}")
-            print(f"ID: {item.get('Id', 'N/A')}")
-            print(f"Type: {item.get('Type', 'N/A')}")
+            lines.append(f"Name: {item.get('Name', 'N/A')}")
+            lines.append(f"ID: {item.get('Id', 'N/A')}")
+            lines.append(f"Type: {item.get('Type', 'N/A')}")
             if 'Description' in item:
-                print(f"Description: {item['Description']}")
+                lines.append(f"Description: {item['Description']}")
             if 'UnitPrice' in item:
-                print(f"Unit Price: ${item['UnitPrice']}")
-            print("-" * 30)
+                lines.append(f"Unit Price: ${item['UnitPrice']}")
+            lines.append("-" * 30)
+        
+        sys.stdout.write("\n".join(lines) + "\n")
     
     def save_to_file(self, customers: List[Dict], items: List[Dict]) -> None:
         """Save fetched data to JSON file for reference."""
@@ -128,8 +227,8 @@ class QuickBooksClient:
             "items": items
         }
         
-        with open(filename, 'w') as f:
-            json.dump(data, f, indent=2)
+        with open(filename, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
         
         print(f"💾 Data saved to: {filename}")
     
@@ -139,26 +238,23 @@ class QuickBooksClient:
         print("🎯 MAPPING TO NOTION CLIENTS")
         print("="*60)
         
-        # Known Notion clients from validation
-        notion_clients = ["ABA", "HumanGood", "Humangood"]
+        # Group customers by the Notion client names found in their name or company, in one scan each
+        matches = {needle: [] for needle in NOTION_CLIENT_NEEDLES}
+        for customer in customers:
+            text = f"{customer.get('Name', '')}\n{customer.get('CompanyName', '')}"
+            for needle in {m.lower() for m in NOTION_CLIENT_RE.findall(text)}:
+                matches[needle].append(customer)
         
         print("Looking for these Notion clients in QuickBooks:")
-        for notion_client in notion_clients:
+        for notion_client in NOTION_CLIENTS:
             print(f"\n🔍 Searching for: {notion_client}")
-            found = False
             
-            for customer in customers:
-                customer_name = customer.get('Name', '').lower()
-                company_name = customer.get('CompanyName', '').lower()
-                
-                if (notion_client.lower() in customer_name or 
-                    notion_client.lower() in company_name):
-                    print(f"   ✅ MATCH: {customer.get('Name')} (ID: {customer.get('Id')})")
-                    if 'CompanyName' in customer:
-                        print(f"      Company: {customer['CompanyName']}")
-                    found = True
+            for customer in matches[notion_client.lower()]:
+                print(f"   ✅ MATCH: {customer.get('Name')} (ID: {customer.get('Id')})")
+                if 'CompanyName' in customer:
+                    print(f"      Company: {customer['CompanyName']}")
             
-            if not found:
+            if not matches[notion_client.lower()]:
                 print(f"   ❌ No match found - may need to create test customer")
 
 
@@ -168,15 +264,21 @@ def main():
     print("=" * 40)
     
     # Initialize client
-    qb_client = QuickBooksClient()
-    
-    print(f"🌍 Environment: {qb_client.qb_config['environment']}")
-    print(f"🏢 Company ID: {qb_client.realm_id}")
-    print()
-    
-    # Fetch data
-    customers = qb_client.get_customers()
-    items = qb_client.get_items()
+    with QuickBooksClient() as qb_client:
+        print(f"🌍 Environment: {qb_client.qb_config['environment']}")
+        print(f"🏢 Company ID: {qb_client.realm_id}")
+        print()
+        
+        # Fetch customers and items in one batch round-trip
+        fetched = qb_client.get_customers_and_items()
+        if fetched is not None:
+            customers, items = fetched
+        else:
+            # Fall back to the two queries, sent concurrently over the pooled session
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                customers_future = executor.submit(qb_client.get_customers)
+                items_future = executor.submit(qb_client.get_items)
+                customers, items = customers_future.result(), items_future.result()
     
     # Display formatted results
     if customers:
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Shared HTTP session for QuickBooks API calls
+Reuses pooled keep-alive connections so repeated calls skip the TCP/TLS handshake,
+and retries transient failures with exponential backoff
+"""
+
+import os
+import json
+import time
+import hashlib
+import orjson
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# QuickBooks API base URLs, in the order environments are probed
+QB_BASE_URLS = {
+    "sandbox": "https://sandbox-quickbooks.api.intuit.com",
+    "production": "https://quickbooks.api.intuit.com"
+}
+
+# QuickBooks accepts at most 30 operations per batch request
+BATCH_LIMIT = 30
+
+# QuickBooks returns at most 1000 rows per query page
+QUERY_PAGE_SIZE = 1000
+
+# Remembers which environment (base URL) each realm lives in between runs
+ENV_CACHE_FILE = ".qb_env_cache.json"
+
+# Query results are cached on disk for a day; customer and item lists rarely change
+QUERY_CACHE_DIR = ".qb_cache"
+QUERY_CACHE_TTL_SECONDS = 24 * 60 * 60
+
+# Transient statuses worth retrying: timeouts, rate limits, and server errors
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+
+
+def create_retry(total: int = 3) -> Retry:
+    """Build the retry policy: exponential backoff with jitter, honoring Retry-After."""
+    return Retry(
+        total=total,
+        backoff_factor=0.5,
+        backoff_jitter=0.25,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(["GET", "POST"]),
+        respect_retry_after_header=True,
+        raise_on_status=False  # Hand the final response back to the caller's error handling
+    )
+
+
+def create_session(pool_connections: int = 4, pool_maxsize: int = 16, max_retries=None) -> requests.Session:
+    """Create a requests session with a pooled, retrying HTTPS adapter."""
+    if max_retries is None:
+        max_retries = create_retry()
+    
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                          max_retries=max_retries)
+    session.mount("https://", adapter)
+    return session
+
+
+# Module-level session shared by the standalone QuickBooks scripts
+SESSION = create_session()
+
+
+def run_batch(base_url: str, realm_id: str, batch_items: List[Dict], session: Optional[requests.Session] = None,
+              **kwargs) -> Dict[str, Dict]:
+    """
+    Submit up to BATCH_LIMIT operations to the QuickBooks batch endpoint in one round-trip.
+    
+    Args:
+        base_url: QuickBooks API base URL (sandbox or production)
+        realm_id: QuickBooks company ID
+        batch_items: BatchItemRequest entries, each with a unique 'bId'
+        session: Session to send the request on (defaults to the shared SESSION)
+        **kwargs: Additional arguments for the POST (params, timeout, ...)
+        
+    Returns:
+        Dict of bId -> BatchItemResponse entry (contains 'QueryResponse', the entity, or 'Fault')
+    """
+    if len(batch_items) > BATCH_LIMIT:
+        raise ValueError(f"QuickBooks batch requests are limited to {BATCH_LIMIT} operations")
+    
+    url = f"{base_url}/v3/company/{realm_id}/batch"
+    # Pre-encode with orjson rather than letting requests run json.dumps on the payload
+    headers = {'Content-Type': 'application/json', **kwargs.pop('headers', {})}
+    response = (session or SESSION).post(url, data=orjson.dumps({'BatchItemRequest': batch_items}),
+                                         headers=headers, **kwargs)
+    response.raise_for_status()
+    
+    return {item['bId']: item for item in orjson.loads(response.content).get('BatchItemResponse', [])}
+
+
+def paged_query(query: str, start_position: int = 1) -> str:
+    """Append STARTPOSITION/MAXRESULTS paging to a QuickBooks SELECT query."""
+    return f"{query} STARTPOSITION {start_position} MAXRESULTS {QUERY_PAGE_SIZE}"
+
+
+def fetch_query_pages(base_url: str, realm_id: str, query: str, entity: str,
+                      total_count: int, first_page: int = 0, max_workers: int = 8,
+                      session: Optional[requests.Session] = None) -> List[Dict]:
+    """
+    Fetch the pages of a QuickBooks query concurrently.
+    
+    Args:
+        base_url: QuickBooks API base URL (sandbox or production)
+        realm_id: QuickBooks company ID
+        query: SELECT query without paging clauses
+        entity: Entity name in the QueryResponse (e.g. 'Customer')
+        total_count: Total row count, from a COUNT(*) query
+        first_page: Index of the first page to fetch (skips pages already in hand)
+        max_workers: Maximum concurrent page requests
+        session: Session to send the requests on (defaults to the shared SESSION)
+        
+    Returns:
+        List of entity records, in page order
+    """
+    url = f"{base_url}/v3/company/{realm_id}/query"
+    session = session or SESSION
+    start_positions = range(1 + first_page * QUERY_PAGE_SIZE, total_count + 1, QUERY_PAGE_SIZE)
+    
+    def fetch_page(start_position):
+        response = session.get(url, params={'query': paged_query(query, start_position)}, timeout=30)
+        response.raise_for_status()
+        return orjson.loads(response.content).get('QueryResponse', {}).get(entity, [])
+    
+    records = []
+    if not start_positions:
+        return records
+    
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(start_positions))) as executor:
+        for page in executor.map(fetch_page, start_positions):
+            records.extend(page)
+    return records
+
+
+def query_all(base_url: str, realm_id: str, entity: str, where: str = "", refresh: bool = False) -> List[Dict]:
+    """
+    Fetch every row of an entity: COUNT(*) first, then all pages concurrently.
+    Results are served from the on-disk query cache when fresh, unless refresh is set.
+    """
+    clause = f" {where}" if where else ""
+    query = f"SELECT * FROM {entity}{clause}"
+    
+    if not refresh:
+        cached = get_cached_query(realm_id, query)
+        if cached is not None:
+            return cached
+    
+    url = f"{base_url}/v3/company/{realm_id}/query"
+    response = SESSION.get(url, params={'query': f"SELECT COUNT(*) FROM {entity}{clause}"}, timeout=30)
+    response.raise_for_status()
+    total_count = orjson.loads(response.content).get('QueryResponse', {}).get('totalCount', 0)
+    
+    records = fetch_query_pages(base_url, realm_id, query, entity, total_count)
+    cache_query(realm_id, query, records)
+    return records
+
+
+def _query_cache_path(realm_id: str, query: str) -> str:
+    """Cache file for a (realm, query) pair."""
+    key = hashlib.sha1(f"{realm_id}|{query}".encode()).hexdigest()
+    return os.path.join(QUERY_CACHE_DIR, f"{key}.json")
+
+
+def get_cached_query(realm_id: str, query: str) -> Optional[List[Dict]]:
+    """Return cached query results if they are younger than the TTL, else None."""
+    path = _query_cache_path(realm_id, query)
+    try:
+        if time.time() - os.path.getmtime(path) > QUERY_CACHE_TTL_SECONDS:
+            return None
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def cache_query(realm_id: str, query: str, records: List[Dict]):
+    """Store query results on disk; empty results are not cached so they are always rechecked."""
+    if not records:
+        return
+    
+    os.makedirs(QUERY_CACHE_DIR, exist_ok=True)
+    path = _query_cache_path(realm_id, query)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(orjson.dumps(records))
+    os.replace(tmp_path, path)
+
+
+def _read_env_cache() -> Dict[str, str]:
+    """Read the realm -> base URL cache, treating a missing or corrupt file as empty."""
+    try:
+        with open(ENV_CACHE_FILE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_env_cache(cache: Dict[str, str]):
+    """Write the realm -> base URL cache atomically."""
+    tmp_file = f"{ENV_CACHE_FILE}.tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp_file, ENV_CACHE_FILE)
+
+
+def get_cached_base_url(realm_id: str) -> Optional[str]:
+    """Return the base URL a previous run detected for this realm, if any."""
+    return _read_env_cache().get(realm_id)
+
+
+def cache_base_url(realm_id: str, base_url: str):
+    """Remember the detected base URL for this realm."""
+    cache = _read_env_cache()
+    if cache.get(realm_id) != base_url:
+        cache[realm_id] = base_url
+        _write_env_cache(cache)
+
+
+def forget_base_url(realm_id: str):
+    """Drop a stale cache entry so the next run probes again."""
+    cache = _read_env_cache()
+    if cache.pop(realm_id, None) is not None:
+        _write_env_cache(cache)
@@ -6,6 +6,35 @@ Interactive script to help set up production QuickBooks credentials
 
 import os
 import sys
+from credentials import load_credentials
+
+
+# Static UI blocks, each emitted with a single write
+_HEADER = (
+    "🚀 PRODUCTION CREDENTIALS SETUP\n"
+    + "=" * 50 + "\n"
+    "\n"
+    "This script will help you configure your production QuickBooks credentials.\n"
+    "You'll need your production app credentials from developer.intuit.com\n"
+    "\n"
+)
+
+_READY = (
+    "✅ Production connection test successful!\n"
+    "\n"
+    "🚀 READY FOR PRODUCTION:\n"
+    "   Use --production flag to run in production mode:\n"
+    "   python populate_invoice_prep.py --production --overage-start 2025-10-01 --overage-end 2025-10-31 --bill-month 2025-12\n"
+)
+
+_SECURITY = (
+    "\n"
+    "🔒 SECURITY REMINDERS:\n"
+    "   • Never commit credentials.production.config to version control\n"
+    "   • Keep production credentials secure and rotate regularly\n"
+    "   • Monitor API usage and set up alerts\n"
+    "\n"
+)
 
 
 def get_user_input(prompt: str, required: bool = True) -> str:
@@ -19,12 +48,7 @@ def get_user_input(prompt: str, required: bool = True) -> str:
 
 def setup_production_credentials():
     """Interactive setup for production credentials."""
-    print("🚀 PRODUCTION CREDENTIALS SETUP")
-    print("=" * 50)
-    print("")
-    print("This script will help you configure your production QuickBooks credentials.")
-    print("You'll need your production app credentials from developer.intuit.com")
-    print("")
+    sys.stdout.write(_HEADER)
     
     # Check if production config already exists
     prod_config = "credentials.production.config"
@@ -34,8 +58,7 @@ def setup_production_credentials():
             print("❌ Setup cancelled.")
             return
     
-    print("📋 Please provide your production QuickBooks credentials:")
-    print("")
+    sys.stdout.write("📋 Please provide your production QuickBooks credentials:\n\n")
     
     # Get QuickBooks credentials
     client_id = get_user_input("🔑 Production Client ID")
@@ -44,28 +67,15 @@ def setup_production_credentials():
     refresh_token = get_user_input("🔄 Production Refresh Token")
     realm_id = get_user_input("🏢 Production Company/Realm ID")
     
-    print("")
-    print("📊 Notion credentials (copying from existing config)...")
-    
-    # Copy Notion credentials from sandbox config
-    notion_token = ""
-    notion_client_hours_db = ""
-    notion_companies_db = ""
-    notion_monthly_prep_db = ""
+    sys.stdout.write("\n📊 Notion credentials (copying from existing config)...\n")
     
+    # Copy Notion credentials from sandbox config (parsed once into a key lookup)
     sandbox_config = "credentials.sandbox.config"
-    if os.path.exists(sandbox_config):
-        with open(sandbox_config, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if line.startswith('NOTION_TOKEN='):
-                    notion_token = line.split('=', 1)[1]
-                elif line.startswith('NOTION_CLIENT_HOURS_DB='):
-                    notion_client_hours_db = line.split('=', 1)[1]
-                elif line.startswith('NOTION_COMPANIES_DB='):
-                    notion_companies_db = line.split('=', 1)[1]
-                elif line.startswith('NOTION_MONTHLY_PREP_DB='):
-                    notion_monthly_prep_db = line.split('=', 1)[1]
+    sandbox_credentials = load_credentials(sandbox_config) if os.path.exists(sandbox_config) else {}
+    notion_token = sandbox_credentials.get('NOTION_TOKEN', '')
+    notion_client_hours_db = sandbox_credentials.get('NOTION_CLIENT_HOURS_DB', '')
+    notion_companies_db = sandbox_credentials.get('NOTION_COMPANIES_DB', '')
+    notion_monthly_prep_db = sandbox_credentials.get('NOTION_MONTHLY_PREP_DB', '')
     
     # Allow user to override Notion credentials if needed
     print(f"   Notion Token: {notion_token[:20]}..." if notion_token else "   Notion Token: Not found")
@@ -96,8 +106,14 @@ NOTION_MONTHLY_PREP_DB={notion_monthly_prep_db}
 """
     
     try:
-        with open(prod_config, 'w') as f:
-            f.write(content)
+        # Owner-only permissions from the moment the file exists (and when overwriting an older file)
+        fd = os.open(prod_config, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.fchmod(fd, 0o600)
+            os.write(fd, content.encode('utf-8'))
+            os.fsync(fd)
+        finally:
+            os.close(fd)
         
         print("")
         print("✅ Production credentials saved successfully!")
@@ -111,11 +127,7 @@ NOTION_MONTHLY_PREP_DB={notion_monthly_prep_db}
             auth = QuickBooksAuthManager(environment="production")
             
             if auth.validate_connection():
-                print("✅ Production connection test successful!")
-                print("")
-                print("🚀 READY FOR PRODUCTION:")
-                print("   Use --production flag to run in production mode:")
-                print("   python populate_invoice_prep.py --production --overage-start 2025-10-01 --overage-end 2025-10-31 --bill-month 2025-12")
+                sys.stdout.write(_READY)
             else:
                 print("❌ Production connection test failed.")
                 print("   Please verify your credentials and try again.")
@@ -131,12 +143,7 @@ NOTION_MONTHLY_PREP_DB={notion_monthly_prep_db}
         print(f"❌ Error saving credentials: {e}")
         return
     
-    print("")
-    print("🔒 SECURITY REMINDERS:")
-    print("   • Never commit credentials.production.config to version control")
-    print("   • Keep production credentials secure and rotate regularly")
-    print("   • Monitor API usage and set up alerts")
-    print("")
+    sys.stdout.write(_SECURITY)
 
 
 if __name__ == "__main__":
@@ -3,20 +3,79 @@
 Simple invoice creation test to debug QB API format
 """
 
+import argparse
+import logging
+import sys
+import uuid
 import requests
-import json
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+from credentials import load_credentials
+from qb_http import BATCH_LIMIT, QB_BASE_URLS, SESSION, run_batch
+from typing import Dict, List, Optional
 
 
-def load_credentials():
-    """Load all credentials from credentials.config."""
-    credentials = {}
-    with open("credentials.config", 'r') as f:
-        for line in f:
-            line = line.strip()
-            if '=' in line and not line.startswith('#'):
-                key, value = line.split('=', 1)
-                credentials[key.strip()] = value.strip()
-    return credentials
+# Console output for this script; payload dumps are DEBUG-level (shown with --verbose)
+logger = logging.getLogger(__name__)
+if not logger.handlers:
+    _console_handler = logging.StreamHandler(sys.stdout)
+    _console_handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_console_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+# Test invoices always go to the sandbox company
+BASE_URL = QB_BASE_URLS['sandbox']
+
+# Minimal invoice structure based on QB API docs (constant, so built once at import)
+TEST_INVOICE = {
+    'CustomerRef': {'value': '58'},  # ABA customer ID
+    'Line': [{
+        'DetailType': 'SalesItemLineDetail',
+        'Amount': 2000.00,
+        'SalesItemLineDetail': {
+            'ItemRef': {'value': '1'},  # Services item
+            'Qty': 1,
+            'UnitPrice': 2000.00
+        }
+    }]
+}
+
+
+def create_invoices_batch(invoice_list: List[Dict], realm_id: str,
+                          session: Optional[requests.Session] = None, max_workers: int = 4) -> List[Dict]:
+    """
+    Create invoices through the QuickBooks batch endpoint, BATCH_LIMIT per round-trip,
+    with up to max_workers batch requests in flight at once. Each batch carries its own
+    requestid, so a retried POST is deduplicated by QuickBooks instead of creating duplicates.
+    
+    Args:
+        invoice_list: Invoice payloads to create
+        realm_id: QuickBooks company ID
+        session: Authorized session to send the batches on (defaults to the shared SESSION)
+        max_workers: Maximum concurrent batch requests
+        
+    Returns:
+        BatchItemResponse entry per invoice, in input order (contains 'Invoice' or 'Fault')
+    """
+    def submit_chunk(start):
+        chunk = invoice_list[start:start + BATCH_LIMIT]
+        responses = run_batch(BASE_URL, realm_id, [
+            {'bId': f"bid{start + i}", 'operation': 'create', 'Invoice': invoice}
+            for i, invoice in enumerate(chunk)
+        ], session=session, params={'requestid': uuid.uuid4().hex})
+        return [responses.get(f"bid{start + i}", {}) for i in range(len(chunk))]
+    
+    starts = range(0, len(invoice_list), BATCH_LIMIT)
+    if len(starts) <= 1:
+        return [item for start in starts for item in submit_chunk(start)]
+    
+    results = []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(starts))) as executor:
+        for chunk_results in executor.map(submit_chunk, starts):
+            results.extend(chunk_results)
+    return results
 
 
 def create_simple_invoice():
@@ -25,49 +84,51 @@ def create_simple_invoice():
     access_token = creds.get('INTUIT_ACCESS_TOKEN')
     realm_id = creds.get('INTUIT_REALM_ID')
     
-    headers = {
+    # Headers are set once on the shared keep-alive session, so repeated submissions reuse its TLS connection
+    SESSION.headers.update({
         'Authorization': f'Bearer {access_token}',
-        'Accept': 'application/json',
-        'Content-Type': 'application/json'
-    }
-    
-    # Minimal invoice structure based on QB API docs
-    invoice_data = {
-        'CustomerRef': {'value': '58'},  # ABA customer ID
-        'Line': [{
-            'DetailType': 'SalesItemLineDetail',
-            'Amount': 2000.00,
-            'SalesItemLineDetail': {
-                'ItemRef': {'value': '1'},  # Services item
-                'Qty': 1,
-                'UnitPrice': 2000.00
-            }
-        }]
-    }
+        'Accept': 'application/json'
+    })
     
-    url = f"https://sandbox-quickbooks.api.intuit.com/v3/company/{realm_id}/invoice"
-    
-    print("🧪 Testing minimal invoice creation...")
-    print(f"URL: {url}")
-    print(f"Data: {json.dumps(invoice_data, indent=2)}")
+    logger.info("🧪 Testing minimal invoice creation...")
+    # The payload is only serialized for display when it will actually be shown
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("URL: %s/v3/company/%s/batch", BASE_URL, realm_id)
+        logger.debug("Data: %s", orjson.dumps(TEST_INVOICE, option=orjson.OPT_INDENT_2).decode())
     
     try:
-        response = requests.post(url, headers=headers, json=invoice_data)
+        result = create_invoices_batch([TEST_INVOICE], realm_id)[0]
         
-        print(f"Status: {response.status_code}")
-        print(f"Response: {response.text}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Response: %s", orjson.dumps(result).decode())
         
-        if response.status_code == 200:
-            result = response.json()
-            if 'QueryResponse' in result and 'Invoice' in result['QueryResponse']:
-                invoice = result['QueryResponse']['Invoice'][0]
-                print(f"✅ Success! Invoice ID: {invoice['Id']}, Number: {invoice.get('DocNumber', 'N/A')}")
-            else:
-                print(f"✅ Success! Response structure: {result.keys()}")
+        if 'Invoice' in result:
+            invoice = result['Invoice']
+            logger.info("✅ Success! Invoice ID: %s, Number: %s", invoice['Id'], invoice.get('DocNumber', 'N/A'))
+        elif 'Fault' in result:
+            logger.error("❌ Invoice rejected: %s", result['Fault'])
+        else:
+            logger.warning("⚠️ Unexpected response structure: %s", result.keys())
         
+    except requests.exceptions.RequestException as e:
+        logger.error("❌ Request failed: %s", e)
+        if e.response is not None:
+            logger.error("Status: %s", e.response.status_code)
+            # Error bodies are decoded once from bytes and truncated; a success body is never decoded to text
+            logger.error("Response: %s", e.response.content[:2048].decode('utf-8', errors='replace'))
     except Exception as e:
-        print(f"❌ Exception: {e}")
+        logger.error("❌ Exception: %s", e)
+
+
+def parse_arguments():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Create a minimal QuickBooks sandbox test invoice')
+    parser.add_argument('--verbose', action='store_true',
+                       help='Show the request URL, payload, and raw response')
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
+    if parse_arguments().verbose:
+        logger.setLevel(logging.DEBUG)
     create_simple_invoice()
\ No newline at end of file